@@ -3,49 +3,986 @@ import json
 import re
 import random
 import os
+import sys
+import time
 from datetime import datetime
 import requests
 import urllib.parse
-import nltk
-import ssl
 import zipfile
 import tempfile
 from pathlib import Path
 import sqlite3
 import hashlib
 import pickle
+import gzip
+import zlib
+import shutil
 import threading
-from collections import defaultdict, Counter
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from collections import defaultdict, Counter, OrderedDict
+try:
+    import fcntl  # межпроцессная блокировка каталога индекса (только POSIX)
+except ImportError:
+    fcntl = None
 import warnings
 warnings.filterwarnings('ignore')
 
-# Обход SSL для NLTK
-try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    pass
-else:
-    ssl._create_default_https_context = _create_unverified_https_context
+# Тяжелые зависимости (numpy, scipy, sklearn, nltk) импортируются лениво,
+# в фоновом прогреве индекса или при первом использовании
 
-# Загрузка данных NLTK
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+# Цель по времени от запуска main() до первого отвеченного запроса
+STARTUP_TARGET_SECONDS = 1.0
+
+# Потоки обработки HTTP-запросов и тайм-аут сокета клиента (секунды)
+HTTP_WORKERS = int(os.environ.get('HTTP_WORKERS', 8))
+HTTP_TIMEOUT = 60
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш ограниченного размера со счетчиками попаданий"""
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        """Получение значения с отметкой о недавнем использовании"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+    
+    def put(self, key, value):
+        """Сохранение значения с вытеснением самого старого"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def discard(self, key):
+        """Удаление значения, если оно есть"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        """Очистка кэша"""
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        """Статистика использования кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+class WriteBehindBuffer:
+    """Буфер отложенной записи: события копятся по ключам и сбрасываются пакетами
+    
+    Сброс происходит по таймеру или при достижении порога; события одного ключа
+    передаются в flush_func в порядке поступления.
+    """
+    
+    def __init__(self, flush_func, flush_interval=2.0, max_pending=500, name='write-behind'):
+        self.flush_func = flush_func
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = OrderedDict()     # ключ -> список событий, ожидающих записи
+        self._in_flight = {}              # события, которые записываются прямо сейчас
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def add(self, key, event):
+        """Добавление события в буфер"""
+        with self._lock:
+            self._pending.setdefault(key, []).append(event)
+            self._count += 1
+            if self._count >= self.max_pending:
+                self._wakeup.set()
+    
+    def pending(self, key):
+        """Еще не записанные события ключа, в порядке поступления"""
+        with self._lock:
+            return self._in_flight.get(key, []) + self._pending.get(key, [])
+    
+    def pending_count(self):
+        """Количество еще не записанных событий"""
+        with self._lock:
+            return self._count + sum(len(events) for events in self._in_flight.values())
+    
+    def flush(self):
+        """Запись всех накопленных событий"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, OrderedDict()
+                self._in_flight = batch
+                self._count = 0
+            
+            try:
+                self.flush_func(batch)
+            except Exception as e:
+                print(f"❌ Ошибка отложенной записи: {e}")
+                # Возвращаем события в буфер перед более новыми
+                with self._lock:
+                    for key, events in self._pending.items():
+                        batch.setdefault(key, []).extend(events)
+                    self._pending = batch
+                    self._count = sum(len(events) for events in batch.values())
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+    
+    def close(self):
+        """Остановка фонового потока с финальным сбросом"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+    
+    def _run(self):
+        """Фоновый цикл сброса"""
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+class JsonStreamReader:
+    """Инкрементальный разбор JSON из файла: значения читаются по одному через raw_decode"""
+    
+    def __init__(self, f, chunk_size=65536):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+    
+    def _fill(self):
+        """Подгрузка следующей порции файла с отбрасыванием прочитанного"""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+    
+    def peek(self):
+        """Следующий значащий символ (None в конце файла)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+    
+    def lookahead_line(self):
+        """Остаток текущей строки без продвижения позиции"""
+        self.peek()
+        while '\n' not in self.buffer[self.pos:] and self._fill():
+            pass
+        return self.buffer[self.pos:].split('\n', 1)[0]
+    
+    def expect(self, char):
+        """Пропуск ожидаемого структурного символа"""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"ожидался '{char}', найден {found!r} (позиция {self.pos})")
+        self.pos += 1
+    
+    def skip_comma(self, closing):
+        """Пропуск разделителя; True, если контейнер закончился"""
+        char = self.peek()
+        if char == ',':
+            self.pos += 1
+            char = self.peek()
+        if char == closing:
+            self.pos += 1
+            return True
+        if char is None:
+            raise ValueError("неожиданный конец файла")
+        return False
+    
+    def read_value(self):
+        """Чтение одного JSON-значения целиком"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Число на границе порции могло прочитаться не полностью:
+                # "456" из "456.5" или "1" из "1e5", если продолжение еще не загружено
+                truncated = end == len(self.buffer) or (
+                    isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and self.buffer[end] in '.eE'
+                )
+                if not truncated or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill():
+                continue
+
+class BatchQueueWriter:
+    """Фоновая пакетная запись через ограниченную очередь
+    
+    Записи собираются в пакеты до batch_size или flush_interval секунд. Если запись
+    отстает, submit блокируется до put_timeout секунд (обратное давление),
+    после чего запись отбрасывается и учитывается в счетчике dropped.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, write_func, maxsize=10000, batch_size=200, flush_interval=1.0,
+                 put_timeout=0.05, name='batch-writer'):
+        self.write_func = write_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def submit(self, record):
+        """Постановка записи в очередь; False, если очередь переполнена"""
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def stats(self):
+        """Состояние очереди записи"""
+        return {'pending': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped}
+    
+    def close(self, timeout=10.0):
+        """Запись оставшихся данных и остановка фонового потока"""
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+    
+    def _run(self):
+        """Фоновый цикл: сбор пакета и запись"""
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                try:
+                    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is self._STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            
+            if batch:
+                try:
+                    self.write_func(batch)
+                    self.written += len(batch)
+                except Exception as e:
+                    print(f"❌ Ошибка фоновой записи ({len(batch)} записей): {e}")
+
+class ReindexScheduler:
+    """Единственный фоновый поток перестройки, объединяющий уведомления об изменениях
+    
+    Перестройка запускается после debounce секунд тишины, но не позже чем через
+    max_staleness секунд после первого необработанного изменения. Все уведомления,
+    пришедшие до запуска, обслуживаются одной перестройкой. Тот же поток выполняет
+    запрошенные слияния (merge_func), если перестройка не ожидается.
+    """
+    
+    def __init__(self, rebuild_func, debounce=1.0, max_staleness=10.0, merge_func=None, name='reindex-worker'):
+        self.rebuild_func = rebuild_func
+        self.merge_func = merge_func
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self.rebuilds = 0
+        self.merges = 0
+        self._merge_requested = False
+        self._pending = 0
+        self._first_change = None
+        self._last_change = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._run_lock = threading.Lock()   # перестройки никогда не идут параллельно
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def notify(self, changes=1):
+        """Уведомление об изменениях, требующих перестройки"""
+        with self._condition:
+            now = time.monotonic()
+            if not self._pending:
+                self._first_change = now
+            self._last_change = now
+            self._pending += changes
+            self._condition.notify()
+    
+    def request_merge(self):
+        """Запрос фонового слияния (повторные запросы до его начала объединяются)"""
+        with self._condition:
+            self._merge_requested = True
+            self._condition.notify()
+    
+    def pending_count(self):
+        """Число изменений, еще не попавших в перестройку"""
+        return self._pending
+    
+    def run_now(self):
+        """Немедленная перестройка в вызывающем потоке с поглощением накопленных уведомлений"""
+        with self._condition:
+            self._pending = 0
+            self._first_change = self._last_change = None
+        self._rebuild()
+    
+    def stats(self):
+        """Состояние планировщика перестроек"""
+        with self._condition:
+            staleness = time.monotonic() - self._first_change if self._pending else 0.0
+        return {'pending_changes': self._pending, 'rebuilds': self.rebuilds, 'merges': self.merges,
+                'merge_requested': self._merge_requested, 'staleness': round(staleness, 3)}
+    
+    def close(self):
+        """Остановка фонового потока (накопленные уведомления отбрасываются)"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+    
+    def _rebuild(self):
+        with self._run_lock:
+            try:
+                self.rebuild_func()
+                self.rebuilds += 1
+            except Exception as e:
+                print(f"❌ Ошибка перестройки индекса: {e}")
+    
+    def _merge(self):
+        with self._run_lock:
+            try:
+                # merge_func возвращает True, если слияние действительно выполнено
+                if self.merge_func():
+                    self.merges += 1
+            except Exception as e:
+                print(f"❌ Ошибка слияния индекса: {e}")
+    
+    def _run(self):
+        """Фоновый цикл: ожидание тишины или предела устаревания, затем одна перестройка
+        
+        Слияние выполняется, только если перестройка не ожидается: она все равно его заменит.
+        """
+        while True:
+            with self._condition:
+                rebuild = False
+                while not self._closed:
+                    if self._pending:
+                        now = time.monotonic()
+                        due = min(self._last_change + self.debounce, self._first_change + self.max_staleness)
+                        if now >= due:
+                            rebuild = True
+                            break
+                        self._condition.wait(due - now)
+                    elif self._merge_requested:
+                        break
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+                self._merge_requested = False
+                if rebuild:
+                    self._pending = 0
+                    self._first_change = self._last_change = None
+            if rebuild:
+                self._rebuild()
+            elif self.merge_func is not None:
+                self._merge()
+
+class SQLiteConnectionManager:
+    """Постоянные SQLite-соединения (по одному на поток) в режиме WAL
+    
+    Соединение живет столько же, сколько поток, поэтому кэш подготовленных
+    выражений sqlite3 (cached_statements) реально переиспользуется между запросами.
+    В режиме WAL читатели не блокируются писателем; записи внутри процесса
+    сериализуются блокировкой, чтобы не упираться в SQLITE_BUSY.
+    """
+    
+    def __init__(self, db_path, cache_size_kb=20000, cached_statements=256, busy_timeout=30.0):
+        self.db_path = db_path
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+    
+    def _connect(self):
+        """Открытие и настройка нового соединения"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            isolation_level=None,       # транзакции управляются явно
+            check_same_thread=False     # нужно только для close_all при остановке
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    def connection(self):
+        """Соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    def execute(self, sql, params=()):
+        """Выполнение одиночного запроса на чтение"""
+        return self.connection().execute(sql, params)
+    
+    @contextmanager
+    def snapshot(self):
+        """Согласованное чтение нескольких запросов из одного состояния базы"""
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+        
+        conn.execute("BEGIN")
+        self._local.read_only = True
+        try:
+            yield conn.cursor()
+        finally:
+            self._local.read_only = False
+            conn.execute("ROLLBACK")
+    
+    @contextmanager
+    def transaction(self):
+        """Транзакция на запись (вложенные вызовы объединяются с внешней)"""
+        with self._write_lock:
+            conn = self.connection()
+            if conn.in_transaction:
+                # Запись внутри snapshot() была бы молча отменена его ROLLBACK
+                if getattr(self._local, 'read_only', False):
+                    raise sqlite3.ProgrammingError("запись внутри транзакции только для чтения (snapshot)")
+                yield conn.cursor()
+                return
+            
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn.cursor()
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+    
+    def close_all(self):
+        """Закрытие всех открытых соединений"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+class KnowledgeEntry:
+    """Компактная запись результата поиска с полями в __slots__
+    
+    Теги декодируются из JSON, а текст ответа загружается только при первом обращении.
+    Поддерживается доступ как к словарю (entry['id'], entry.get('score', 0)).
+    """
+    
+    __slots__ = ('id', 'question', 'category', 'intent', '_tags', 'confidence', 'usage_count',
+                 'success_rate', 'created_at', 'updated_at', 'source', '_answer', '_answer_loader',
+                 'score', 'text_score', 'similarity_score')
+    
+    FIELDS = ('id', 'question', 'category', 'intent', 'tags', 'confidence', 'usage_count', 'success_rate',
+              'created_at', 'updated_at', 'source', 'answer', 'score', 'text_score', 'similarity_score')
+    OPTIONAL_FIELDS = ('answer', 'score', 'text_score', 'similarity_score')
+    
+    def __init__(self, id, question, category, intent, tags, confidence, usage_count, success_rate,
+                 created_at, updated_at, source, answer=None, answer_loader=None):
+        self.id = id
+        self.question = question
+        self.category = category
+        self.intent = intent
+        self._tags = tags                 # JSON-строка до первого обращения
+        self.confidence = confidence
+        self.usage_count = usage_count
+        self.success_rate = success_rate
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.source = source
+        self._answer = answer
+        self._answer_loader = answer_loader
+        self.score = None
+        self.text_score = None
+        self.similarity_score = None
+    
+    @property
+    def tags(self):
+        """Теги записи (JSON декодируется при первом обращении)"""
+        if self._tags is None or isinstance(self._tags, str):
+            self._tags = json.loads(self._tags) if self._tags else []
+        return self._tags
+    
+    @tags.setter
+    def tags(self, value):
+        self._tags = value
+    
+    @property
+    def answer(self):
+        """Текст ответа (загружается из базы при первом обращении)"""
+        if self._answer is None and self._answer_loader is not None:
+            self._answer = self._answer_loader(self.id)
+        return self._answer
+    
+    @answer.setter
+    def answer(self, value):
+        self._answer = value
+    
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None and key in self.OPTIONAL_FIELDS:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        if key == 'answer':
+            return self._answer is not None
+        return key in self.FIELDS and (key not in self.OPTIONAL_FIELDS or getattr(self, key) is not None)
+    
+    def get(self, key, default=None):
+        """Значение поля или default, как у dict.get"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        """Имена заполненных полей"""
+        return [key for key in self.FIELDS if key in self]
+    
+    def copy(self):
+        """Поверхностная копия записи"""
+        entry = KnowledgeEntry.__new__(KnowledgeEntry)
+        for name in self.__slots__:
+            setattr(entry, name, getattr(self, name))
+        return entry
+    
+    def to_dict(self):
+        """Преобразование в обычный словарь (для сериализации)"""
+        return {key: self[key] for key in self.keys()}
+    
+    def __repr__(self):
+        return f"KnowledgeEntry(id={self.id!r}, question={self.question!r}, score={self.score!r})"
+
+class MinHasher:
+    """MinHash-сигнатуры текстов и ключи LSH-полос для поиска почти одинаковых вопросов
+    
+    Текст разбивается на слова; сигнатура - минимумы bands*rows
+    универсальных хеш-функций. Каждая полоса из rows значений сворачивается
+    в один 64-битный ключ; кандидатами считаются документы, совпавшие
+    с запросом хотя бы по одному ключу.
+    """
+    
+    PRIME = 2147483647
+    KEY_MULTIPLIER = 0x9E3779B97F4A7C15
+    
+    def __init__(self, bands=16, rows=4, seed=42):
+        import numpy as np
+        
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, self.PRIME, bands * rows).astype(np.uint64)
+        self.b = rng.randint(0, self.PRIME, bands * rows).astype(np.uint64)
+    
+    def _shingles(self, text):
+        """Хеши слов текста"""
+        import numpy as np
+        
+        shingles = set(re.findall(r'\w+', text)) or {text}
+        return np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles], dtype=np.uint64)
+    
+    def signatures_for(self, texts):
+        """Сигнатуры для списка текстов одним векторизованным проходом"""
+        import numpy as np
+        
+        shingles = [self._shingles(text) for text in texts]
+        if not shingles:
+            return np.empty((0, len(self.a)), dtype=np.uint32)
+        offsets = np.cumsum([0] + [len(item) for item in shingles[:-1]])
+        hashes = (np.concatenate(shingles)[:, None] * self.a + self.b) % self.PRIME
+        return np.minimum.reduceat(hashes, offsets, axis=0).astype(np.uint32)
+    
+    def band_keys(self, signatures):
+        """Ключи полос (строки - документы, столбцы - полосы) как int64 для SQLite"""
+        import numpy as np
+        
+        values = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        keys = np.zeros((len(signatures), self.bands), dtype=np.uint64)
+        for row in range(self.rows):
+            # Переполнение uint64 здесь ожидаемо: это хеширование по модулю 2^64
+            keys = keys * np.uint64(self.KEY_MULTIPLIER) + values[:, :, row]
+        return keys.view(np.int64)
+    
+    @staticmethod
+    def similarity(signature, other):
+        """Оценка сходства Жаккара по доле совпавших значений сигнатур"""
+        import numpy as np
+        
+        return float(np.mean(signature == other))
+
+class IndexSnapshot:
+    """Неизменяемый снимок векторного индекса с номером поколения
+    
+    Векторизатор, матрицы, id и категории документов публикуются вместе одной
+    заменой ссылки: читатель берет снимок без блокировки и никогда не видит старую
+    матрицу в паре с новым списком id. Любое изменение индекса - это сборка нового снимка.
+    """
+    
+    __slots__ = ('generation', 'vectorizer', 'vectors', 'delta', 'base_ids', 'delta_ids',
+                 'base_categories', 'delta_categories', 'category_rows', 'doc_freq', 'ann_index', '_idf')
+    
+    FIELDS = __slots__[:-1]
+    
+    def __init__(self, generation=None, vectorizer=None, vectors=None, delta=None, base_ids=(), delta_ids=(),
+                 base_categories=(), delta_categories=(), category_rows=None, doc_freq=None, ann_index=None):
+        self.generation = generation
+        self.vectorizer = vectorizer
+        self.vectors = vectors                      # основной сегмент (memmap после сохранения)
+        self.delta = delta                          # строки, добавленные после последнего слияния
+        self.base_ids = base_ids                    # id документов основного сегмента
+        self.delta_ids = tuple(delta_ids)
+        self.base_categories = base_categories      # категории в порядке строк основного сегмента
+        self.delta_categories = tuple(delta_categories)
+        self.category_rows = category_rows or {}    # категория -> номера строк основного сегмента
+        self.doc_freq = doc_freq
+        self.ann_index = ann_index
+        self._idf = None
+    
+    @property
+    def base_count(self):
+        return self.vectors.shape[0] if self.vectors is not None else 0
+    
+    @property
+    def doc_count(self):
+        return len(self.base_ids) + len(self.delta_ids)
+    
+    @property
+    def is_empty(self):
+        return self.vectors is None and self.delta is None
+    
+    def idf(self):
+        """Сглаженные IDF-веса по частотам документов снимка (вычисляются один раз)"""
+        import numpy as np
+        
+        if self._idf is None and self.doc_freq is not None:
+            self._idf = np.log((1 + self.doc_count) / (1 + self.doc_freq)) + 1
+        return self._idf
+    
+    def replace(self, **changes):
+        """Новый снимок с измененными полями"""
+        values = {name: getattr(self, name) for name in self.FIELDS}
+        values.update(changes)
+        return IndexSnapshot(**values)
+
+class AnnIndex:
+    """Приближенный поиск ближайших соседей: LSA-эмбеддинги + инвертированные списки (IVF)
+    
+    TF-IDF векторы сжимаются TruncatedSVD до плотных эмбеддингов, которые хранятся
+    в float16. Проекция хранится только для реально встречающихся признаков
+    хеш-пространства, а не для всех 2^18. Документы разбиваются k-means примерно на sqrt(N) кластеров, и запрос
+    сравнивается только с документами nprobe ближайших кластеров, поэтому время
+    поиска растет сублинейно с размером корпуса.
+    """
+    
+    def __init__(self, n_components=128, nprobe=16, seed=42):
+        self.n_components = n_components
+        self.nprobe = nprobe
+        self.seed = seed
+        self.feature_map = None     # признак хеш-пространства -> столбец проекции (-1 - нет)
+        self.projection = None      # (число активных признаков, размерность)
+        self.centroids = None
+        self.lists = []
+        self.embeddings = None      # буфер float16 с запасом под новые строки
+        self.size = 0
+    
+    def build(self, matrix):
+        """Обучение SVD и кластеров по матрице TF-IDF"""
+        import numpy as np
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.decomposition import TruncatedSVD
+        
+        n_docs = matrix.shape[0]
+        active = np.flatnonzero(matrix.getnnz(axis=0))
+        self.feature_map = np.full(matrix.shape[1], -1, dtype=np.int32)
+        self.feature_map[active] = np.arange(len(active), dtype=np.int32)
+        
+        n_components = max(1, min(self.n_components, n_docs - 1, len(active) - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=self.seed)
+        svd.fit(self._compact(matrix))
+        self.projection = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        embeddings = self.embed(matrix)
+        
+        n_lists = max(1, int(np.sqrt(n_docs)))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=self.seed, n_init=3)
+        labels = kmeans.fit_predict(embeddings.astype(np.float32))
+        self.centroids = self._normalize(kmeans.cluster_centers_.astype(np.float32))
+        
+        # Инвертированные списки: номера строк, сгруппированные по кластерам
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+        
+        self.embeddings = embeddings
+        self.size = n_docs
+        return embeddings
+    
+    def embed(self, matrix):
+        """Плотные нормированные эмбеддинги в float16"""
+        import numpy as np
+        
+        dense = np.asarray(self._compact(matrix) @ self.projection, dtype=np.float32)
+        return self._normalize(dense).astype(np.float16)
+    
+    def _compact(self, matrix):
+        """Перевод строк из хеш-пространства в пространство активных признаков"""
+        import numpy as np
+        from scipy import sparse
+        
+        matrix = matrix.tocsr()
+        columns = self.feature_map[matrix.indices]
+        keep = columns >= 0
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        n_active = int(self.feature_map.max()) + 1
+        return sparse.csr_matrix(
+            (matrix.data[keep], (rows[keep], columns[keep])),
+            shape=(matrix.shape[0], n_active)
+        )
+    
+    def extend(self, matrix):
+        """Добавление строк в ближайшие кластеры без переобучения"""
+        import numpy as np
+        
+        embeddings = self.embed(matrix)
+        count = embeddings.shape[0]
+        
+        if self.size + count > self.embeddings.shape[0]:
+            capacity = max(self.size + count, self.embeddings.shape[0] * 2)
+            grown = np.zeros((capacity, self.embeddings.shape[1]), dtype=np.float16)
+            grown[:self.size] = self.embeddings[:self.size]
+            self.embeddings = grown
+        self.embeddings[self.size:self.size + count] = embeddings
+        
+        labels = np.argmax(embeddings.astype(np.float32) @ self.centroids.T, axis=1)
+        positions = np.arange(self.size, self.size + count)
+        lists = list(self.lists)
+        for label in np.unique(labels):
+            lists[label] = np.concatenate([lists[label], positions[labels == label]])
+        
+        # Списки публикуются после записи эмбеддингов, чтобы читатели не видели пустые строки
+        self.lists = lists
+        self.size += count
+        return embeddings
+    
+    def search(self, query_vec, k, allowed_rows=None):
+        """Top-k строк по кластерам, ближайшим к запросу"""
+        import numpy as np
+        
+        query = self.embed(query_vec)[0].astype(np.float32)
+        lists = self.lists
+        
+        nprobe = min(self.nprobe, len(lists))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        candidates = np.concatenate([lists[i] for i in probe])
+        
+        if allowed_rows is not None:
+            # allowed_rows отсортирован, проверка принадлежности через двоичный поиск
+            found = np.searchsorted(allowed_rows, candidates)
+            found = np.minimum(found, len(allowed_rows) - 1)
+            candidates = candidates[allowed_rows[found] == candidates] if len(allowed_rows) else candidates[:0]
+        
+        if not len(candidates):
+            return candidates, np.empty(0)
+        
+        scores = self.embeddings[candidates].astype(np.float32) @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return candidates[top], scores[top]
+    
+    def _normalize(self, vectors):
+        """L2-нормировка строк плотной матрицы"""
+        import numpy as np
+        
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
 
 class AdvancedKnowledgeDatabase:
     """Продвинутая база знаний с SQLite и векторным поиском"""
     
-    def __init__(self, db_path="ai_knowledge.db"):
+    INDEX_FORMAT_VERSION = 5
+    HASH_FEATURES = 2 ** 18
+    DELTA_MERGE_THRESHOLD = 256
+    SQL_BATCH_SIZE = 500
+    # Поля, нужные для ранжирования; тяжелый текст ответа загружается отдельно
+    RANKING_COLUMNS = 'id, question, category, intent, tags, confidence, usage_count, success_rate, created_at, updated_at, source'
+    # Веса BM25 для колонок question, answer, tags полнотекстового индекса
+    BM25_WEIGHTS = (10.0, 1.0, 5.0)
+    # Меньше этого числа строк точный перебор быстрее приближенного поиска
+    ANN_MIN_DOCUMENTS = 5000
+    # Предел кандидатов из ближайших кластеров, пересчитываемых точным TF-IDF сходством
+    ANN_MAX_CANDIDATES = 10000
+    SEARCH_CACHE_SIZE = 1024
+    USAGE_FLUSH_INTERVAL = 2.0
+    USAGE_FLUSH_THRESHOLD = 500
+    EXPORT_CHUNK_SIZE = 500
+    IMPORT_BATCH_SIZE = 500
+    DUPLICATE_THRESHOLD = 0.8
+    DUPLICATE_CONFIDENCE_BOOST = 0.05
+    MINHASH_BUILD_BATCH = 1000
+    CONVERSATION_QUEUE_SIZE = 10000
+    CONVERSATION_BATCH_SIZE = 200
+    REINDEX_DEBOUNCE = 1.0
+    REINDEX_MAX_STALENESS = 10.0
+    
+    def __init__(self, db_path="ai_knowledge.db", background_warm_up=True, vector_engine=None,
+                 reindex_debounce=None, reindex_max_staleness=None):
         self.db_path = db_path
-        self.vectorizer = TfidfVectorizer(max_features=10000, stop_words=self._russian_stop_words())
-        self.vectors = None
-        self.doc_ids = []
+        # 'exact' - полный перебор, 'ann' - приближенный поиск по LSA-эмбеддингам
+        self.vector_engine = vector_engine or os.environ.get('AI_VECTOR_ENGINE', 'exact')
+        self.ann_recall = None
+        self.search_cache = LRUCache(self.SEARCH_CACHE_SIZE)
+        self._minhasher = None       # создается при первой записи вопросов
+        self.duplicates_merged = 0
+        self._search_cache_generation = None
+        self.db = SQLiteConnectionManager(db_path)
+        self.usage_buffer = WriteBehindBuffer(
+            self._flush_usage, self.USAGE_FLUSH_INTERVAL, self.USAGE_FLUSH_THRESHOLD, name='usage-writer'
+        )
+        self.conversation_writer = BatchQueueWriter(
+            self._write_conversations, self.CONVERSATION_QUEUE_SIZE, self.CONVERSATION_BATCH_SIZE,
+            name='conversation-writer'
+        )
+        self.index_path = f"{db_path}.index"      # указатель на текущий набор файлов индекса
+        self.index_dir = f"{db_path}.index.d"     # наборы файлов индекса по поколениям
+        self.vectorizer = None       # создается при прогреве индекса
+        self.index = IndexSnapshot() # текущий снимок; читается без блокировки
+        self._index_lock = threading.Lock()  # сериализует только сборку новых снимков
+        self._index_ready = threading.Event()
+        # Полные перестройки индекса выполняет один поток с задержкой и объединением
+        self.reindexer = ReindexScheduler(
+            self._load_vectors,
+            self.REINDEX_DEBOUNCE if reindex_debounce is None else reindex_debounce,
+            self.REINDEX_MAX_STALENESS if reindex_max_staleness is None else reindex_max_staleness,
+            merge_func=self._merge_delta
+        )
+        self._stemmer = None
+        self.stop_words = set(self._russian_stop_words())
+        self.fts_enabled = False
         self._init_database()
-        self._load_vectors()
+        
+        # Индекс загружается в фоне, чтобы не задерживать запуск сервера;
+        # поиск по векторам дождется окончания прогрева
+        if background_warm_up:
+            threading.Thread(target=self._warm_up, daemon=True).start()
+        else:
+            self._warm_up()
+    
+    def _warm_up(self):
+        """Прогрев: импорт зависимостей и загрузка векторного индекса"""
+        started = time.perf_counter()
+        try:
+            # Через планировщик: прогрев не пересекается с run_now() из пакетной загрузки
+            self.reindexer.run_now()
+            self._get_stemmer()
+        finally:
+            self._index_ready.set()
+        print(f"🔥 Векторный индекс готов за {(time.perf_counter() - started) * 1000:.0f} мс")
+    
+    def _ensure_index(self):
+        """Ожидание окончания прогрева индекса"""
+        self._index_ready.wait()
+    
+    @property
+    def indexed_generation(self):
+        """Поколение базы, которому соответствует опубликованный индекс"""
+        return self.index.generation
+    
+    def _get_vectorizer(self):
+        """Хеширующий векторизатор (создается при первом обращении)"""
+        if self.vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            # Хеширующий векторизатор не хранит словарь и не требует обучения,
+            # IDF считается по отдельно поддерживаемым частотам документов
+            self.vectorizer = HashingVectorizer(
+                n_features=self.HASH_FEATURES,
+                alternate_sign=False,
+                norm=None,
+                stop_words=self._russian_stop_words()
+            )
+        return self.vectorizer
+    
+    def _get_stemmer(self):
+        """Стеммер для русского языка (nltk импортируется при первом поиске)"""
+        if self._stemmer is None:
+            from nltk.stem.snowball import SnowballStemmer
+            self._stemmer = SnowballStemmer('russian')
+        return self._stemmer
+    
+    def _stem(self, word):
+        """Основа слова; пока стеммер грузится при прогреве - грубое отсечение окончания"""
+        if self._stemmer is None and not self._index_ready.is_set():
+            # Импорт nltk занимает около секунды и не должен задерживать первые запросы
+            return word[:-2].rstrip('аеёиоуыэюяйь') if len(word) > 4 else word.rstrip('аеёиоуыэюяйь')
+        return self._get_stemmer().stem(word)
     
     def _russian_stop_words(self):
         """Русские стоп-слова для векторизации"""
@@ -65,9 +1002,23 @@ class AdvancedKnowledgeDatabase:
     
     def _init_database(self):
         """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.db.transaction() as cursor:
+            self._create_schema(cursor)
         
+        # Инициализация базовых знаний
+        self._initialize_base_knowledge()
+    
+    def _create_schema(self, cursor):
+        """Создание таблиц, индексов и триггеров"""
+        self._create_tables(cursor)
+        self._create_question_hash(cursor)
+        self._create_tag_index(cursor)
+        self._create_minhash_index(cursor)
+        self._create_statistics(cursor)
+        self.fts_enabled = self._create_fts_index(cursor)
+    
+    def _create_tables(self, cursor):
+        """Создание основных таблиц"""
         # Основная таблица знаний
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS knowledge (
@@ -129,11 +1080,284 @@ class AdvancedKnowledgeDatabase:
             )
         ''')
         
-        conn.commit()
-        conn.close()
+        # Служебные метаданные: поколение содержимого базы знаний
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS kb_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO kb_meta (key, value) VALUES ('generation', 0)")
+        
+        # Любое изменение проиндексированных полей увеличивает поколение,
+        # по нему проверяется актуальность сохраненного индекса
+        cursor.execute("DROP TRIGGER IF EXISTS knowledge_generation_update")
+        for name, event in (('insert', 'INSERT'), ('delete', 'DELETE'), ('update', 'UPDATE OF question, category, tags')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS knowledge_generation_{name}
+                AFTER {event} ON knowledge
+                BEGIN
+                    UPDATE kb_meta SET value = value + 1 WHERE key = 'generation';
+                END
+            ''')
+    
+    def _create_question_hash(self, cursor):
+        """Колонка с хэшем нормализованного вопроса для upsert при импорте"""
+        cursor.execute("PRAGMA table_info(knowledge)")
+        if 'question_hash' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE knowledge ADD COLUMN question_hash TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_question_hash ON knowledge(question_hash)")
         
-        # Инициализация базовых знаний
-        self._initialize_base_knowledge()
+        # Заполнение хэшей для записей, добавленных до появления колонки
+        cursor.execute("SELECT id, question FROM knowledge WHERE question_hash IS NULL")
+        while True:
+            rows = cursor.fetchmany(self.SQL_BATCH_SIZE)
+            if not rows:
+                break
+            self.db.connection().executemany(
+                "UPDATE knowledge SET question_hash = ? WHERE id = ?",
+                [(self.question_hash(question), knowledge_id) for knowledge_id, question in rows]
+            )
+    
+    def _create_tag_index(self, cursor):
+        """Нормализованная таблица тегов: tag -> knowledge_id"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'knowledge_tags'")
+        exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_tags (
+                tag TEXT NOT NULL,
+                knowledge_id INTEGER NOT NULL,
+                PRIMARY KEY (tag, knowledge_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_tags_id ON knowledge_tags(knowledge_id)")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS knowledge_tags_delete
+            AFTER DELETE ON knowledge
+            BEGIN
+                DELETE FROM knowledge_tags WHERE knowledge_id = old.id;
+            END
+        ''')
+        
+        # Заполнение по уже существующим записям
+        if not exists:
+            cursor.execute("SELECT id, tags FROM knowledge")
+            while True:
+                rows = cursor.fetchmany(self.SQL_BATCH_SIZE)
+                if not rows:
+                    break
+                self._write_tags(self.db.connection(), [
+                    (knowledge_id, json.loads(tags) if tags else []) for knowledge_id, tags in rows
+                ])
+    
+    @staticmethod
+    def normalize_tag(tag):
+        """Нормализация тега: регистр и пробелы"""
+        return ' '.join(str(tag).lower().split())
+    
+    def _write_tags(self, cursor, items, replace=False):
+        """Запись тегов для пар (knowledge_id, список тегов)"""
+        if replace:
+            cursor.executemany("DELETE FROM knowledge_tags WHERE knowledge_id = ?",
+                               [(knowledge_id,) for knowledge_id, _ in items])
+        cursor.executemany(
+            "INSERT OR IGNORE INTO knowledge_tags (tag, knowledge_id) VALUES (?, ?)",
+            [
+                (self.normalize_tag(tag), knowledge_id)
+                for knowledge_id, tags in items for tag in (tags or []) if self.normalize_tag(tag)
+            ]
+        )
+    
+    def _create_minhash_index(self, cursor):
+        """Ключи LSH-полос вопросов: (band, key) -> knowledge_id, плюс сигнатура в knowledge.minhash"""
+        cursor.execute("PRAGMA table_info(knowledge)")
+        if 'minhash' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE knowledge ADD COLUMN minhash BLOB")
+        # Частичный индекс: поиск записей без сигнатуры не требует полного просмотра таблицы
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_minhash_missing ON knowledge(id) WHERE minhash IS NULL")
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_minhash (
+                band INTEGER NOT NULL,
+                key INTEGER NOT NULL,
+                knowledge_id INTEGER NOT NULL,
+                PRIMARY KEY (band, key, knowledge_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_knowledge_minhash_id ON knowledge_minhash(knowledge_id)")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS knowledge_minhash_delete
+            AFTER DELETE ON knowledge
+            BEGIN
+                DELETE FROM knowledge_minhash WHERE knowledge_id = old.id;
+            END
+        ''')
+        # Измененный вопрос теряет сигнатуру и будет заново обработан при следующем запуске
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS knowledge_minhash_update
+            AFTER UPDATE OF question ON knowledge
+            BEGIN
+                DELETE FROM knowledge_minhash WHERE knowledge_id = old.id;
+                UPDATE knowledge SET minhash = NULL WHERE id = new.id;
+            END
+        ''')
+        
+        # Заполнение для записей без сигнатуры, порциями по возрастанию id
+        last_id = 0
+        while True:
+            cursor.execute(
+                "SELECT id, question FROM knowledge WHERE minhash IS NULL AND id > ? ORDER BY id LIMIT ?",
+                (last_id, self.MINHASH_BUILD_BATCH)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            self._write_minhash(cursor, rows)
+            last_id = rows[-1][0]
+    
+    def _get_minhasher(self):
+        """Общий MinHasher (numpy импортируется при первом использовании)"""
+        if self._minhasher is None:
+            self._minhasher = MinHasher()
+        return self._minhasher
+    
+    def _write_minhash(self, cursor, items, signatures=None):
+        """Запись сигнатур и ключей полос для пар (knowledge_id, вопрос)"""
+        if not items:
+            return
+        minhasher = self._get_minhasher()
+        if signatures is None:
+            signatures = minhasher.signatures_for([self.normalize_query(question) for _, question in items])
+        keys = minhasher.band_keys(signatures)
+        
+        cursor.executemany(
+            "UPDATE knowledge SET minhash = ? WHERE id = ?",
+            [(signature.tobytes(), knowledge_id) for (knowledge_id, _), signature in zip(items, signatures)]
+        )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO knowledge_minhash (band, key, knowledge_id) VALUES (?, ?, ?)",
+            [
+                (band, int(key), knowledge_id)
+                for (knowledge_id, _), row in zip(items, keys) for band, key in enumerate(row)
+            ]
+        )
+    
+    def _create_statistics(self, cursor):
+        """Счетчики статистики, поддерживаемые триггерами в тех же транзакциях, что и изменения"""
+        cursor.execute("SELECT 1 FROM kb_meta WHERE key = 'total_entries'")
+        exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_category_stats (
+                category TEXT PRIMARY KEY,
+                entries INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        add_new = """
+            UPDATE kb_meta SET value = value + 1 WHERE key = 'total_entries';
+            UPDATE kb_meta SET value = value + (new.source = 'web') WHERE key = 'web_entries';
+            UPDATE kb_meta SET value = value + new.usage_count WHERE key = 'total_usage';
+            INSERT OR IGNORE INTO knowledge_category_stats (category, entries) VALUES (new.category, 0);
+            UPDATE knowledge_category_stats SET entries = entries + 1 WHERE category = new.category;
+        """
+        remove_old = """
+            UPDATE kb_meta SET value = value - 1 WHERE key = 'total_entries';
+            UPDATE kb_meta SET value = value - (old.source = 'web') WHERE key = 'web_entries';
+            UPDATE kb_meta SET value = value - old.usage_count WHERE key = 'total_usage';
+            UPDATE knowledge_category_stats SET entries = entries - 1 WHERE category = old.category;
+            DELETE FROM knowledge_category_stats WHERE category = old.category AND entries <= 0;
+        """
+        for name, event, body in (
+            ('insert', 'INSERT', add_new),
+            ('delete', 'DELETE', remove_old),
+            ('update', 'UPDATE OF category, source, usage_count', remove_old + add_new)
+        ):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS knowledge_stats_{name}
+                AFTER {event} ON knowledge
+                BEGIN
+                    {body}
+                END
+            ''')
+        
+        # Базы, созданные до появления счетчиков, пересчитываются один раз
+        if not exists:
+            self._recount_statistics(cursor)
+    
+    def recount_statistics(self):
+        """Полный пересчет счетчиков статистики по таблице knowledge (для сверки)"""
+        with self.db.transaction() as cursor:
+            self._recount_statistics(cursor)
+        return self.get_statistics()
+    
+    def _recount_statistics(self, cursor):
+        """Пересчет счетчиков статистики внутри текущей транзакции"""
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(source = 'web'), 0), COALESCE(SUM(usage_count), 0)
+            FROM knowledge
+        ''')
+        total, web_count, total_usage = cursor.fetchone()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO kb_meta (key, value) VALUES (?, ?)",
+            [('total_entries', total), ('web_entries', web_count), ('total_usage', total_usage)]
+        )
+        cursor.execute("DELETE FROM knowledge_category_stats")
+        cursor.execute('''
+            INSERT INTO knowledge_category_stats (category, entries)
+            SELECT category, COUNT(*) FROM knowledge GROUP BY category
+        ''')
+    
+    def _create_fts_index(self, cursor):
+        """Полнотекстовый индекс FTS5 по вопросам, ответам и тегам"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'knowledge_fts'")
+        exists = cursor.fetchone() is not None
+        
+        if not exists:
+            try:
+                # Бесконтентная таблица: хранит только индекс, строки берутся из knowledge
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE knowledge_fts USING fts5(
+                        question, answer, tags,
+                        content='',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )
+                ''')
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ FTS5 недоступен, текстовый поиск будет упрощенным: {e}")
+                return False
+        
+        # Теги хранятся как JSON, в индекс попадают сами слова
+        tags_text = "(CASE WHEN json_valid({0}.tags) THEN (SELECT group_concat(value, ' ') FROM json_each({0}.tags)) ELSE {0}.tags END)"
+        insert_new = f"""
+            INSERT INTO knowledge_fts (rowid, question, answer, tags)
+            VALUES (new.id, new.question, new.answer, {tags_text.format('new')});
+        """
+        delete_old = f"""
+            INSERT INTO knowledge_fts (knowledge_fts, rowid, question, answer, tags)
+            VALUES ('delete', old.id, old.question, old.answer, {tags_text.format('old')});
+        """
+        for name, event, body in (
+            ('insert', 'INSERT', insert_new),
+            ('delete', 'DELETE', delete_old),
+            ('update', 'UPDATE OF question, answer, tags', delete_old + insert_new)
+        ):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS knowledge_fts_{name}
+                AFTER {event} ON knowledge
+                BEGIN
+                    {body}
+                END
+            ''')
+        
+        if not exists:
+            cursor.execute(f'''
+                INSERT INTO knowledge_fts (rowid, question, answer, tags)
+                SELECT id, question, answer, {tags_text.format('knowledge')} FROM knowledge
+            ''')
+        
+        return True
     
     def _initialize_base_knowledge(self):
         """Инициализация расширенной базы знаний"""
@@ -174,162 +1398,1187 @@ class AdvancedKnowledgeDatabase:
              "SQL (Structured Query Language) - язык структурированных запросов для работы с реляционными базами данных.\n\n**Основные команды SQL:**\n\n```sql\n-- Создание таблицы\nCREATE TABLE users (\n    id INTEGER PRIMARY KEY,\n    name TEXT NOT NULL,\n    email TEXT UNIQUE,\n    age INTEGER\n);\n\n-- Вставка данных\nINSERT INTO users (name, email, age) \nVALUES ('Иван', 'ivan@example.com', 30);\n\n-- Выборка данных\nSELECT * FROM users WHERE age > 25;\n\n-- Обновление данных\nUPDATE users SET age = 31 WHERE name = 'Иван';\n\n-- Удаление данных\nDELETE FROM users WHERE age < 18;\n```\n\n**Типы JOIN в SQL:**\n• INNER JOIN - пересечение множеств\n• LEFT JOIN - все записи из левой таблицы\n• RIGHT JOIN - все записи из правой таблицы\n• FULL OUTER JOIN - объединение множеств",
              "databases", "explanation", ["sql", "база данных", "реляционная"]),
             
-            # Искусственный интеллект
-            ("Что такое машинное обучение?",
-             "Машинное обучение (Machine Learning) - это раздел искусственного интеллекта, позволяющий компьютерам обучаться на данных без явного программирования.\n\n**Основные типы ML:**\n\n🔹 **Обучение с учителем (Supervised Learning)**\n• Классификация - предсказание категорий\n• Регрессия - предсказание числовых значений\n\n🔹 **Обучение без учителя (Unsupervised Learning)**\n• Кластеризация - группировка похожих объектов\n• Снижение размерности - упрощение данных\n\n🔹 **Обучение с подкреплением (Reinforcement Learning)**\n• Агент учится на основе взаимодействия со средой\n\n**Популярные алгоритмы:**\n• Линейная регрессия\n• Деревья решений\n• Метод k-ближайших соседей\n• Нейронные сети\n• Метод опорных векторов",
-             "ai", "explanation", ["машинное обучение", "искусственный интеллект", "ml", "ai"]),
+            # Искусственный интеллект
+            ("Что такое машинное обучение?",
+             "Машинное обучение (Machine Learning) - это раздел искусственного интеллекта, позволяющий компьютерам обучаться на данных без явного программирования.\n\n**Основные типы ML:**\n\n🔹 **Обучение с учителем (Supervised Learning)**\n• Классификация - предсказание категорий\n• Регрессия - предсказание числовых значений\n\n🔹 **Обучение без учителя (Unsupervised Learning)**\n• Кластеризация - группировка похожих объектов\n• Снижение размерности - упрощение данных\n\n🔹 **Обучение с подкреплением (Reinforcement Learning)**\n• Агент учится на основе взаимодействия со средой\n\n**Популярные алгоритмы:**\n• Линейная регрессия\n• Деревья решений\n• Метод k-ближайших соседей\n• Нейронные сети\n• Метод опорных векторов",
+             "ai", "explanation", ["машинное обучение", "искусственный интеллект", "ml", "ai"]),
+            
+            ("Что такое нейронные сети?",
+             "Нейронные сети - это вычислительные системы, вдохновленные биологическими нейронными сетями мозга.\n\n**Основные компоненты:**\n• 🧠 **Нейроны** - базовые вычислительные единицы\n• 🔗 **Связи** - взвешенные соединения между нейронами\n• 📊 **Функция активации** - определяет выход нейрона\n• 🎯 **Слои** - входной, скрытые, выходной\n\n**Типы нейронных сетей:**\n• Полносвязные (Fully Connected)\n• Сверточные (CNN) - для изображений\n• Рекуррентные (RNN) - для последовательностей\n• Трансформеры - для NLP\n\n**Пример простой нейросети на Python с Keras:**\n```python\nfrom tensorflow import keras\nfrom tensorflow.keras import layers\n\nmodel = keras.Sequential([\n    layers.Dense(64, activation='relu', input_shape=(784,)),\n    layers.Dense(64, activation='relu'),\n    layers.Dense(10, activation='softmax')\n])\n\nmodel.compile(optimizer='adam',\n              loss='categorical_crossentropy',\n              metrics=['accuracy'])\n```",
+             "ai", "explanation", ["нейронные сети", "искусственный интеллект", "deep learning"]),
+            
+            # Общие знания
+            ("Как работает интернет?",
+             "Интернет - это глобальная сеть соединенных компьютеров, общающихся по стандартным протоколам.\n\n**Основные компоненты:**\n\n🌐 **Протоколы:**\n• TCP/IP - базовый протокол передачи данных\n• HTTP/HTTPS - протоколы веб-страниц\n• DNS - система доменных имен\n• SMTP - протокол электронной почты\n\n🔗 **Как работает запрос к сайту:**\n1. Браузер отправляет DNS-запрос\n2. DNS-сервер возвращает IP-адрес\n3. Устанавливается TCP-соединение\n4. Отправляется HTTP-запрос\n5. Сервер возвращает HTTP-ответ\n6. Браузер отображает страницу\n\n**Технологии веб-разработки:**\n• Frontend: HTML, CSS, JavaScript\n• Backend: Python, PHP, Node.js, Java\n• Базы данных: MySQL, PostgreSQL, MongoDB\n• Веб-серверы: Nginx, Apache",
+             "technology", "explanation", ["интернет", "протоколы", "веб"]),
+            
+            ("Что такое блокчейн?",
+             "Блокчейн - это децентрализованная распределенная база данных, состоящая из цепочки блоков.\n\n**Ключевые особенности:**\n• 🔗 **Децентрализация** - нет центрального контролирующего органа\n• 🔒 **Неизменяемость** - данные нельзя изменить после записи\n• ⛓️ **Прозрачность** - все транзакции видны участникам\n• 💎 **Безопасность** - криптографическая защита\n\n**Принцип работы:**\n1. Транзакции группируются в блоки\n2. Блоки проверяются сетью (майнинг)\n3. Проверенный блок добавляется в цепочку\n4. Каждый блок содержит хеш предыдущего блока\n\n**Применение:**\n• Криптовалюты (Bitcoin, Ethereum)\n• Смарт-контракты\n• Цифровая идентификация\n• Цепочки поставок",
+             "technology", "explanation", ["блокчейн", "криптовалюты", "децентрализация"]),
+        ]
+        
+        # Проверяем, нужно ли добавлять базовые знания
+        count = self.db.execute("SELECT COUNT(*) FROM knowledge").fetchone()[0]
+        
+        if count == 0:
+            print("📖 Инициализация расширенной базы знаний...")
+            fields = ('question', 'answer', 'category', 'intent', 'tags')
+            # Индекс будет построен в __init__ сразу после инициализации
+            self.add_knowledge_many([dict(zip(fields, item)) for item in base_knowledge], reindex=False)
+            print("✅ База знаний инициализирована с расширенными данными")
+    
+    def add_knowledge(self, question, answer, category, intent, tags=None, confidence=1.0, source="manual"):
+        """Добавление знания в базу данных
+        
+        Почти дубликат существующего вопроса той же категории не добавляется:
+        вместо этого повышается уверенность найденной записи и возвращается ее id.
+        """
+        tags_str = json.dumps(tags if tags else [])
+        question_hash = self.question_hash(question)
+        signature = self._get_minhasher().signatures_for([self.normalize_query(question)])[0]
+        
+        with self.db.transaction() as cursor:
+            duplicate_id = self._find_duplicate(cursor, question_hash, signature, category)
+            if duplicate_id is not None:
+                cursor.execute('''
+                    UPDATE knowledge
+                    SET confidence = MIN(1.0, MAX(confidence, ?) + ?),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (confidence, self.DUPLICATE_CONFIDENCE_BOOST, duplicate_id))
+            else:
+                cursor.execute('''
+                    INSERT INTO knowledge (question, answer, category, intent, tags, confidence, source, question_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (question, answer, category, intent, tags_str, confidence, source, question_hash))
+                knowledge_id = cursor.lastrowid
+                self._write_tags(cursor, [(knowledge_id, tags)])
+                self._write_minhash(cursor, [(knowledge_id, question)], signature[None])
+                generation = self._get_generation(cursor)
+        
+        if duplicate_id is not None:
+            # Уверенность входит в закэшированные результаты и фильтр min_confidence
+            self.duplicates_merged += 1
+            self.search_cache.clear()
+            return duplicate_id
+        
+        # Добавляем запись в индекс без полной перестройки
+        self._index_document(knowledge_id, question, category, generation)
+        
+        return knowledge_id
+    
+    def _find_duplicate(self, cursor, question_hash, signature, category):
+        """Поиск записи той же категории с тем же или почти тем же вопросом"""
+        import numpy as np
+        
+        cursor.execute(
+            "SELECT id FROM knowledge WHERE question_hash = ? AND category = ? ORDER BY id LIMIT 1",
+            (question_hash, category)
+        )
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        
+        # Кандидаты - записи той же категории, совпавшие хотя бы в одной полосе
+        minhasher = self._get_minhasher()
+        keys = minhasher.band_keys(signature[None])[0]
+        conditions = ' OR '.join(['(band = ? AND key = ?)'] * len(keys))
+        cursor.execute(f'''
+            SELECT id, minhash FROM knowledge
+            WHERE category = ? AND id IN (SELECT knowledge_id FROM knowledge_minhash WHERE {conditions})
+        ''', [category] + [value for band, key in enumerate(keys) for value in (band, int(key))])
+        
+        best = None
+        for doc_id, stored in cursor.fetchall():
+            if stored is None:
+                continue
+            similarity = minhasher.similarity(np.frombuffer(stored, dtype=np.uint32), signature)
+            # Из равных по сходству выбирается самая ранняя запись
+            if similarity >= self.DUPLICATE_THRESHOLD and (best is None or (similarity, -doc_id) > best):
+                best = (similarity, -doc_id)
+        return -best[1] if best else None
+    
+    def add_knowledge_many(self, entries, source="manual", reindex=True):
+        """Массовое добавление знаний одной транзакцией с единственной перестройкой индекса"""
+        rows = [
+            (
+                entry['question'],
+                entry['answer'],
+                entry.get('category') or 'general',
+                entry.get('intent') or 'information',
+                json.dumps(entry.get('tags') or []),
+                entry.get('confidence', 1.0),
+                entry.get('source', source),
+                entry.get('usage_count', 0),
+                entry.get('success_rate', 1.0),
+                self.question_hash(entry['question'])
+            )
+            for entry in entries
+        ]
+        
+        if not rows:
+            return 0
+        
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM knowledge")
+            last_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO knowledge (question, answer, category, intent, tags, confidence, source,
+                                       usage_count, success_rate, question_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self._index_inserted(cursor, last_id)
+        
+        if reindex:
+            self.reindexer.run_now()
+        
+        return len(rows)
+    
+    def import_knowledge(self, filename):
+        """Потоковый импорт знаний: knowledge_base.json (по категориям), JSON-список или NDJSON (.gz)
+        
+        Записи сопоставляются по хэшу нормализованного вопроса: существующие обновляются,
+        новые добавляются; индекс перестраивается один раз в конце.
+        """
+        inserted = updated = 0
+        batch = []
+        
+        try:
+            opener = gzip.open if str(filename).endswith('.gz') else open
+            with opener(filename, 'rt', encoding='utf-8') as f:
+                for entry in self._iter_import_records(f):
+                    if not entry.get('question') or not entry.get('answer'):
+                        continue
+                    batch.append(entry)
+                    if len(batch) >= self.IMPORT_BATCH_SIZE:
+                        added, changed = self._upsert_knowledge(batch)
+                        inserted, updated = inserted + added, updated + changed
+                        batch = []
+            if batch:
+                added, changed = self._upsert_knowledge(batch)
+                inserted, updated = inserted + added, updated + changed
+        except (OSError, ValueError) as e:
+            print(f"❌ Ошибка импорта {filename}: {e}")
+        
+        if inserted or updated:
+            self.reindexer.run_now()
+        
+        print(f"📥 Импортировано записей: {inserted} новых, {updated} обновлено")
+        return inserted + updated
+    
+    def _iter_import_records(self, f):
+        """Записи из файла импорта по одной, без загрузки файла целиком"""
+        reader = JsonStreamReader(f)
+        first = reader.peek()
+        
+        if first == '[':
+            # Формат export_knowledge(format='json'): список записей
+            reader.expect('[')
+            while not reader.skip_comma(']'):
+                yield reader.read_value()
+            return
+        
+        if first != '{':
+            return
+        
+        # Если первая строка - целый объект-запись, это NDJSON: значения идут подряд
+        try:
+            record = json.loads(reader.lookahead_line())
+        except json.JSONDecodeError:
+            record = None
+        
+        if isinstance(record, dict) and 'categories' not in record:
+            while reader.peek() is not None:
+                yield reader.read_value()
+            return
+        
+        # Формат knowledge_base.json: {"categories": {"категория": [записи]}, ...}
+        reader.expect('{')
+        while not reader.skip_comma('}'):
+            key = reader.read_value()
+            reader.expect(':')
+            if key != 'categories':
+                reader.read_value()
+                continue
+            reader.expect('{')
+            while not reader.skip_comma('}'):
+                category = reader.read_value()
+                reader.expect(':')
+                reader.expect('[')
+                while not reader.skip_comma(']'):
+                    yield dict(reader.read_value(), category=category)
+    
+    def _upsert_knowledge(self, entries):
+        """Добавление или обновление пакета записей по хэшу вопроса в одной транзакции
+        
+        Совпадающие записи без изменений не трогаются, чтобы не сдвигать поколение индекса.
+        """
+        by_hash = {}
+        for entry in entries:
+            by_hash[self.question_hash(entry['question'])] = entry
+        
+        hashes = list(by_hash)
+        placeholders = ','.join('?' * len(hashes))
+        
+        with self.db.transaction() as cursor:
+            cursor.execute(f'''
+                SELECT question_hash, id, answer, category, intent, tags, confidence FROM knowledge
+                WHERE id IN (SELECT MIN(id) FROM knowledge WHERE question_hash IN ({placeholders})
+                             GROUP BY question_hash)
+            ''', hashes)
+            existing = {row[0]: row[1:] for row in cursor.fetchall()}
+            
+            updates = []
+            for question_hash, entry in by_hash.items():
+                if question_hash not in existing:
+                    continue
+                knowledge_id, answer, category, intent, tags, confidence = existing[question_hash]
+                values = (
+                    entry['answer'],
+                    entry.get('category') or 'general',
+                    entry.get('intent') or 'information',
+                    entry.get('tags') or [],
+                    entry.get('confidence', 1.0)
+                )
+                if values == (answer, category, intent, json.loads(tags) if tags else [], confidence):
+                    continue
+                updates.append(values[:3] + (json.dumps(values[3]), values[4], knowledge_id))
+            
+            inserts = [
+                (
+                    entry['question'],
+                    entry['answer'],
+                    entry.get('category') or 'general',
+                    entry.get('intent') or 'information',
+                    json.dumps(entry.get('tags') or []),
+                    entry.get('confidence', 1.0),
+                    entry.get('source') or 'import',
+                    entry.get('usage_count', 0),
+                    entry.get('success_rate', 1.0),
+                    entry.get('created_at'),
+                    question_hash
+                )
+                for question_hash, entry in by_hash.items() if question_hash not in existing
+            ]
+            
+            cursor.executemany('''
+                UPDATE knowledge
+                SET answer = ?, category = ?, intent = ?, tags = ?, confidence = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', updates)
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM knowledge")
+            last_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO knowledge (question, answer, category, intent, tags, confidence, source,
+                                       usage_count, success_rate, created_at, question_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+            ''', inserts)
+            
+            self._write_tags(cursor, [(row[-1], json.loads(row[3])) for row in updates], replace=True)
+            self._index_inserted(cursor, last_id)
+        
+        return len(inserts), len(updates)
+    
+    def _index_inserted(self, cursor, last_id):
+        """Теги и MinHash-ключи записей, добавленных после last_id в текущей транзакции"""
+        cursor.execute("SELECT id, question, tags FROM knowledge WHERE id > ?", (last_id,))
+        rows = cursor.fetchall()
+        self._write_tags(cursor, [(knowledge_id, json.loads(tags) if tags else []) for knowledge_id, _, tags in rows])
+        self._write_minhash(cursor, [(knowledge_id, question) for knowledge_id, question, _ in rows])
+    
+    def search_knowledge(self, query, category=None, min_confidence=0.3, limit=5, fetch_answers=True, tags=None):
+        """Поиск в базе знаний с использованием векторного поиска
+        
+        tags ограничивает результаты записями, у которых есть хотя бы один из указанных тегов.
+        """
+        tags = sorted({self.normalize_tag(tag) for tag in tags}) if tags else None
+        
+        if not self._index_ready.is_set():
+            # Прогрев индекса еще идет: отвечаем только полнотекстовым поиском, не кэшируя
+            all_results = self._merge_results(
+                self._text_search(query, category, min_confidence, limit, tags), [], query
+            )[:limit]
+            if fetch_answers:
+                self.load_answers(all_results)
+            return all_results
+        
+        # Кэш привязан к поколению индекса: любое изменение индекса сбрасывает его
+        generation = self.indexed_generation
+        if generation != self._search_cache_generation:
+            self.search_cache.clear()
+            self._search_cache_generation = generation
+        
+        cache_key = (generation, self.normalize_query(query), category, min_confidence, limit, tuple(tags or ()))
+        cached = self.search_cache.get(cache_key)
+        
+        if cached is not None:
+            all_results = [result.copy() for result in cached]
+        else:
+            # Текстовый поиск
+            text_results = self._text_search(query, category, min_confidence, limit*2, tags)
+            
+            # Векторный поиск
+            vector_results = self._vector_search(query, category, limit*2, tags=tags)
+            
+            # Объединяем и ранжируем результаты
+            all_results = self._merge_results(text_results, vector_results, query)[:limit]
+            self.search_cache.put(cache_key, [result.copy() for result in all_results])
+        
+        # Ответы подгружаются только для итоговых результатов, одним запросом
+        if fetch_answers:
+            self.load_answers(all_results)
+        
+        return all_results
+    
+    @staticmethod
+    def normalize_query(query):
+        """Нормализация текста запроса: регистр, пробелы, завершающая пунктуация"""
+        return ' '.join(query.lower().split()).rstrip('?!. ')
+    
+    @classmethod
+    def question_hash(cls, question):
+        """Хэш нормализованного текста вопроса"""
+        return hashlib.sha1(cls.normalize_query(question).encode('utf-8')).hexdigest()
+    
+    def _tagged_ids(self, tags):
+        """Отсортированный массив id записей, имеющих хотя бы один из тегов"""
+        import numpy as np
+        
+        ids = set()
+        for chunk in self._chunks(list(tags)):
+            placeholders = ','.join('?' * len(chunk))
+            ids.update(row[0] for row in self.db.execute(
+                f'SELECT knowledge_id FROM knowledge_tags WHERE tag IN ({placeholders})', chunk
+            ))
+        return np.array(sorted(ids), dtype=np.int64)
+    
+    def _tag_filter_sql(self, tags, column='id'):
+        """SQL-условие и параметры фильтра по тегам"""
+        if not tags:
+            return '', []
+        placeholders = ','.join('?' * len(tags))
+        return f'AND {column} IN (SELECT knowledge_id FROM knowledge_tags WHERE tag IN ({placeholders}))', list(tags)
+    
+    def load_answers(self, results):
+        """Загрузка текста ответов для результатов поиска"""
+        missing = [result for result in results if 'answer' not in result]
+        answers = {}
+        for chunk in self._chunks([result['id'] for result in missing]):
+            placeholders = ','.join('?' * len(chunk))
+            answers.update(self.db.execute(
+                f'SELECT id, answer FROM knowledge WHERE id IN ({placeholders})', chunk
+            ).fetchall())
+        
+        for result in missing:
+            result['answer'] = answers.get(result['id'], '')
+        return results
+    
+    def _fetch_ranking_rows(self, ids):
+        """Получение полей для ранжирования по списку id одним запросом на пакет"""
+        rows = {}
+        for chunk in self._chunks(list(ids)):
+            placeholders = ','.join('?' * len(chunk))
+            for row in self.db.execute(
+                f'SELECT {self.RANKING_COLUMNS} FROM knowledge WHERE id IN ({placeholders})', chunk
+            ):
+                rows[row[0]] = row
+        return rows
+    
+    def _chunks(self, items):
+        """Разбиение списка на пакеты, укладывающиеся в лимит параметров SQLite"""
+        for start in range(0, len(items), self.SQL_BATCH_SIZE):
+            yield items[start:start + self.SQL_BATCH_SIZE]
+    
+    def _text_search(self, query, category, min_confidence, limit, tags=None):
+        """Полнотекстовый поиск FTS5 с ранжированием BM25"""
+        if not self.fts_enabled:
+            return self._popular_search(category, min_confidence, limit, tags)
+        
+        match = self._build_fts_query(query)
+        if not match:
+            return []
+        
+        columns = ', '.join(f'k.{column}' for column in self.RANKING_COLUMNS.split(', '))
+        weights = ', '.join(str(weight) for weight in self.BM25_WEIGHTS)
+        category_filter = 'AND k.category = ?' if category else ''
+        tag_filter, tag_params = self._tag_filter_sql(tags, 'k.id')
+        params = [match, min_confidence] + ([category] if category else []) + tag_params + [limit]
+        
+        try:
+            rows = self.db.execute(f'''
+                SELECT {columns}, bm25(knowledge_fts, {weights}) AS rank
+                FROM knowledge_fts
+                JOIN knowledge k ON k.id = knowledge_fts.rowid
+                WHERE knowledge_fts MATCH ? AND k.confidence >= ? {category_filter} {tag_filter}
+                ORDER BY rank
+                LIMIT ?
+            ''', params).fetchall()
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка полнотекстового поиска: {e}")
+            return []
+        
+        results = []
+        for row in rows:
+            result = self._row_to_entry(row)
+            # BM25 в SQLite отрицателен (лучше - меньше), приводим к шкале 0..1
+            relevance = max(0.0, -row[-1])
+            result['text_score'] = relevance / (1.0 + relevance)
+            results.append(result)
+        
+        return results
+    
+    def _build_fts_query(self, query):
+        """Построение запроса FTS5: основы слов с префиксным поиском через OR"""
+        terms = []
+        for word in re.findall(r'\w+', query.lower()):
+            if len(word) < 2 or word in self.stop_words:
+                continue
+            # Основа слова покрывает падежные формы: "классы" -> класс*
+            stem = self._stem(word)
+            term = f'"{stem}"*' if len(stem) >= 3 else f'"{word}"'
+            if term not in terms:
+                terms.append(term)
+        return ' OR '.join(terms)
+    
+    def _popular_search(self, category, min_confidence, limit, tags=None):
+        """Запасной поиск без FTS5: самые используемые записи"""
+        cursor = self.db.connection().cursor()
+        tag_filter, tag_params = self._tag_filter_sql(tags)
+        
+        if category:
+            cursor.execute(f'''
+                SELECT {self.RANKING_COLUMNS} FROM knowledge 
+                WHERE category = ? AND confidence >= ? {tag_filter}
+                ORDER BY usage_count DESC, confidence DESC
+                LIMIT ?
+            ''', [category, min_confidence] + tag_params + [limit])
+        else:
+            cursor.execute(f'''
+                SELECT {self.RANKING_COLUMNS} FROM knowledge 
+                WHERE confidence >= ? {tag_filter}
+                ORDER BY usage_count DESC, confidence DESC
+                LIMIT ?
+            ''', [min_confidence] + tag_params + [limit])
+        
+        results = []
+        for row in cursor.fetchall():
+            result = self._row_to_entry(row)
+            result['text_score'] = result['confidence']
+            results.append(result)
+        
+        return results
+    
+    def _vector_search(self, query, category, limit, engine=None, tags=None, index=None):
+        """Векторный поиск с использованием TF-IDF
+        
+        index задает снимок явно: так поиск работает и до окончания прогрева.
+        """
+        import numpy as np
+        
+        if index is None:
+            self._ensure_index()
+            # Весь поиск идет по одному снимку, взятому одной операцией чтения
+            index = self.index
+        engine = engine or self.vector_engine
+        if index.is_empty:
+            return []
+        base, delta, ann = index.vectors, index.delta, index.ann_index
+        base_count = index.base_count
+        
+        try:
+            # Преобразуем запрос в вектор
+            query_vec = self._weight_rows(index.vectorizer.transform([query]), index.idf())
+            
+            # Оцениваем только строки нужной категории и тегов, а не весь корпус
+            allowed_ids = self._tagged_ids(tags) if tags else None
+            base_rows, delta_rows = self._segment_rows(index, category, allowed_ids)
+            
+            scores, positions = [], []
+            if base is not None:
+                rows = base_rows if base_rows is not None else np.arange(base_count)
+                
+                if engine == 'ann' and ann is not None and len(rows) >= self.ANN_MIN_DOCUMENTS:
+                    # ANN отбирает кандидатов, итоговое сходство считается точно;
+                    # строки, добавленные в ANN после этого снимка, отбрасываются
+                    rows, _ = ann.search(query_vec, self.ANN_MAX_CANDIDATES, base_rows)
+                    rows = np.sort(rows[rows < base_count])
+                    scores.append(self._score_rows(base, rows, query_vec))
+                else:
+                    scores.append(self._score_rows(base, rows, query_vec, whole=base_rows is None))
+                positions.append(rows)
+            if delta is not None:
+                rows = delta_rows if delta_rows is not None else np.arange(delta.shape[0])
+                scores.append(self._score_rows(delta, rows, query_vec, whole=delta_rows is None))
+                positions.append(rows + base_count)
+            
+            similarities = np.concatenate(scores)
+            positions = np.concatenate(positions)
+            
+            # Частичный отбор top-k вместо полной сортировки
+            k = min(limit, len(similarities))
+            if k <= 0:
+                return []
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top], kind='stable')]
+            
+            top_ids = self._resolve_doc_ids(positions[top], index)
+            rows = self._fetch_ranking_rows(doc_id for doc_id in top_ids if doc_id is not None)
+            
+            results = []
+            for i, doc_id in zip(top, top_ids):
+                row = rows.get(doc_id)
+                if row:
+                    result = self._row_to_entry(row)
+                    result['similarity_score'] = float(similarities[i])
+                    results.append(result)
+            
+            return results
+            
+        except Exception as e:
+            print(f"❌ Ошибка векторного поиска: {e}")
+            return []
+    
+    def _segment_rows(self, index, category, allowed_ids):
+        """Номера строк основного и добавочного сегментов снимка, прошедших фильтры (None - все строки)"""
+        import numpy as np
+        
+        base_rows = delta_rows = None
+        if category:
+            base_rows = index.category_rows.get(category)
+            if base_rows is None:
+                base_rows = np.empty(0, dtype=np.int64)
+            delta_rows = np.flatnonzero(np.array([c == category for c in index.delta_categories], dtype=bool))
+        
+        if allowed_ids is not None:
+            rows = base_rows if base_rows is not None else np.arange(index.base_count)
+            base_rows = rows[np.isin(np.asarray(index.base_ids)[rows], allowed_ids)]
+            rows = delta_rows if delta_rows is not None else np.arange(len(index.delta_ids))
+            delta_ids = np.array(index.delta_ids, dtype=np.int64)
+            delta_rows = rows[np.isin(delta_ids[rows], allowed_ids)] if len(rows) else rows
+        
+        return base_rows, delta_rows
+    
+    def search_knowledge_batch(self, queries, category=None, limit=5, tags=None):
+        """Пакетный векторный поиск: одно преобразование, одно умножение матриц и один SQL-запрос на пакет id"""
+        import numpy as np
+        
+        queries = list(queries)
+        if not queries:
+            return []
+        
+        self._ensure_index()
+        index = self.index
+        if index.is_empty:
+            return [[] for _ in queries]
+        base, delta = index.vectors, index.delta
+        base_count = index.base_count
+        
+        try:
+            # Все запросы преобразуются одним вызовом
+            query_matrix = self._weight_rows(index.vectorizer.transform(queries), index.idf())
+            
+            allowed_ids = self._tagged_ids({self.normalize_tag(tag) for tag in tags}) if tags else None
+            base_rows, delta_rows = self._segment_rows(index, category, allowed_ids)
+            
+            segments = []
+            if base is not None:
+                segments.append(self._score_batch(base, base_rows, query_matrix, 0))
+            if delta is not None:
+                segments.append(self._score_batch(delta, delta_rows, query_matrix, base_count))
+            
+            # Top-k для каждого запроса по ненулевым элементам его строки
+            hits = []
+            for q in range(len(queries)):
+                similarities = np.concatenate([
+                    scores.data[scores.indptr[q]:scores.indptr[q + 1]] for scores, _ in segments
+                ])
+                positions = np.concatenate([
+                    rows[scores.indices[scores.indptr[q]:scores.indptr[q + 1]]] for scores, rows in segments
+                ])
+                k = min(limit, len(similarities))
+                if k <= 0:
+                    hits.append([])
+                    continue
+                top = np.argpartition(-similarities, k - 1)[:k]
+                top = top[np.argsort(-similarities[top], kind='stable')]
+                top_ids = self._resolve_doc_ids(positions[top], index)
+                hits.append([
+                    (doc_id, float(similarities[i]))
+                    for i, doc_id in zip(top, top_ids) if doc_id is not None
+                ])
             
-            ("Что такое нейронные сети?",
-             "Нейронные сети - это вычислительные системы, вдохновленные биологическими нейронными сетями мозга.\n\n**Основные компоненты:**\n• 🧠 **Нейроны** - базовые вычислительные единицы\n• 🔗 **Связи** - взвешенные соединения между нейронами\n• 📊 **Функция активации** - определяет выход нейрона\n• 🎯 **Слои** - входной, скрытые, выходной\n\n**Типы нейронных сетей:**\n• Полносвязные (Fully Connected)\n• Сверточные (CNN) - для изображений\n• Рекуррентные (RNN) - для последовательностей\n• Трансформеры - для NLP\n\n**Пример простой нейросети на Python с Keras:**\n```python\nfrom tensorflow import keras\nfrom tensorflow.keras import layers\n\nmodel = keras.Sequential([\n    layers.Dense(64, activation='relu', input_shape=(784,)),\n    layers.Dense(64, activation='relu'),\n    layers.Dense(10, activation='softmax')\n])\n\nmodel.compile(optimizer='adam',\n              loss='categorical_crossentropy',\n              metrics=['accuracy'])\n```",
-             "ai", "explanation", ["нейронные сети", "искусственный интеллект", "deep learning"]),
+            # Одна гидратация для всех найденных документов
+            rows = self._fetch_ranking_rows({doc_id for query_hits in hits for doc_id, _ in query_hits})
             
-            # Общие знания
-            ("Как работает интернет?",
-             "Интернет - это глобальная сеть соединенных компьютеров, общающихся по стандартным протоколам.\n\n**Основные компоненты:**\n\n🌐 **Протоколы:**\n• TCP/IP - базовый протокол передачи данных\n• HTTP/HTTPS - протоколы веб-страниц\n• DNS - система доменных имен\n• SMTP - протокол электронной почты\n\n🔗 **Как работает запрос к сайту:**\n1. Браузер отправляет DNS-запрос\n2. DNS-сервер возвращает IP-адрес\n3. Устанавливается TCP-соединение\n4. Отправляется HTTP-запрос\n5. Сервер возвращает HTTP-ответ\n6. Браузер отображает страницу\n\n**Технологии веб-разработки:**\n• Frontend: HTML, CSS, JavaScript\n• Backend: Python, PHP, Node.js, Java\n• Базы данных: MySQL, PostgreSQL, MongoDB\n• Веб-серверы: Nginx, Apache",
-             "technology", "explanation", ["интернет", "протоколы", "веб"]),
+            batch_results = []
+            for query_hits in hits:
+                results = []
+                for doc_id, similarity in query_hits:
+                    row = rows.get(doc_id)
+                    if row:
+                        result = self._row_to_entry(row)
+                        result['similarity_score'] = similarity
+                        results.append(result)
+                batch_results.append(results)
             
-            ("Что такое блокчейн?",
-             "Блокчейн - это децентрализованная распределенная база данных, состоящая из цепочки блоков.\n\n**Ключевые особенности:**\n• 🔗 **Децентрализация** - нет центрального контролирующего органа\n• 🔒 **Неизменяемость** - данные нельзя изменить после записи\n• ⛓️ **Прозрачность** - все транзакции видны участникам\n• 💎 **Безопасность** - криптографическая защита\n\n**Принцип работы:**\n1. Транзакции группируются в блоки\n2. Блоки проверяются сетью (майнинг)\n3. Проверенный блок добавляется в цепочку\n4. Каждый блок содержит хеш предыдущего блока\n\n**Применение:**\n• Криптовалюты (Bitcoin, Ethereum)\n• Смарт-контракты\n• Цифровая идентификация\n• Цепочки поставок",
-             "technology", "explanation", ["блокчейн", "криптовалюты", "децентрализация"]),
-        ]
-        
-        # Проверяем, нужно ли добавлять базовые знания
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM knowledge")
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            print("📖 Инициализация расширенной базы знаний...")
-            for question, answer, category, intent, tags in base_knowledge:
-                self.add_knowledge(question, answer, category, intent, tags)
-            print("✅ База знаний инициализирована с расширенными данными")
+            return batch_results
+            
+        except Exception as e:
+            print(f"❌ Ошибка пакетного поиска: {e}")
+            return [[] for _ in queries]
+    
+    def _resolve_doc_ids(self, positions, index):
+        """Перевод номеров строк снимка в id документов (None для номеров вне снимка)"""
+        base_ids, delta_ids = index.base_ids, index.delta_ids
+        base_count = len(base_ids)
+        resolved = []
+        for position in positions:
+            if position < base_count:
+                resolved.append(int(base_ids[position]))
+            elif position - base_count < len(delta_ids):
+                resolved.append(delta_ids[position - base_count])
+            else:
+                resolved.append(None)
+        return resolved
+    
+    def _score_batch(self, segment, rows, query_matrix, offset):
+        """Сходство всех запросов со строками сегмента одним разреженным произведением"""
+        import numpy as np
         
-        conn.close()
+        if rows is None:
+            rows = np.arange(segment.shape[0])
+        else:
+            segment = segment[rows]
+        scores = (query_matrix @ segment.T).tocsr()
+        return scores, rows + offset
     
-    def add_knowledge(self, question, answer, category, intent, tags=None, confidence=1.0, source="manual"):
-        """Добавление знания в базу данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def evaluate_ann_recall(self, queries, k=5, category=None, index=None):
+        """Recall@k приближенного поиска относительно точного перебора
         
-        tags_str = json.dumps(tags if tags else [])
+        Результат ANN засчитывается, если его сходство не ниже k-го точного результата,
+        так что документы с равным сходством не считаются промахами.
+        """
+        if index is None:
+            self._ensure_index()
+            index = self.index
         
-        cursor.execute('''
-            INSERT INTO knowledge (question, answer, category, intent, tags, confidence, source)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (question, answer, category, intent, tags_str, confidence, source))
+        recalls = []
+        for query in queries:
+            exact = self._vector_search(query, category, k, engine='exact', index=index)
+            if not exact:
+                continue
+            threshold = exact[-1]['similarity_score'] - 1e-9
+            approximate = self._vector_search(query, category, k, engine='ann', index=index)
+            hits = sum(1 for r in approximate if r['similarity_score'] >= threshold)
+            recalls.append(hits / len(exact))
         
-        conn.commit()
-        conn.close()
+        recall = sum(recalls) / len(recalls) if recalls else 0.0
+        print(f"📏 ANN recall@{k}: {recall:.3f} (запросов: {len(recalls)})")
+        return recall
+    
+    def _report_ann_recall(self, index, sample_size=50, k=5):
+        """Оценка recall@k ANN на случайных вопросах из самой базы
         
-        # Обновляем векторное представление
-        self._update_vectors()
+        Снимок передается явно: оценка идет при прогреве, когда ожидать готовности индекса нельзя.
+        """
+        doc_ids = index.base_ids
+        if index.ann_index is None or not len(doc_ids):
+            return
         
-        return cursor.lastrowid
+        sample = [int(doc_ids[i]) for i in random.sample(range(len(doc_ids)), min(sample_size, len(doc_ids)))]
+        placeholders = ','.join('?' * len(sample))
+        queries = [row[0] for row in self.db.execute(
+            f'SELECT question FROM knowledge WHERE id IN ({placeholders})', sample
+        )]
+        self.ann_recall = self.evaluate_ann_recall(queries, k, index=index)
     
-    def search_knowledge(self, query, category=None, min_confidence=0.3, limit=5):
-        """Поиск в базе знаний с использованием векторного поиска"""
-        # Текстовый поиск
-        text_results = self._text_search(query, category, min_confidence, limit*2)
-        
-        # Векторный поиск
-        vector_results = self._vector_search(query, category, limit*2)
+    def _build_ann_index(self, vectors, doc_ids):
+        """Построение ANN-индекса и запись квантованных эмбеддингов в базу"""
+        if self.vector_engine != 'ann' or vectors is None or vectors.shape[0] < self.ANN_MIN_DOCUMENTS:
+            return None
         
-        # Объединяем и ранжируем результаты
-        all_results = self._merge_results(text_results, vector_results, query)
+        ann = AnnIndex()
+        embeddings = ann.build(vectors)
+        self._store_embeddings(doc_ids, embeddings)
+        return ann
+    
+    def _store_embeddings(self, doc_ids, embeddings):
+        """Сохранение эмбеддингов float16 в колонку knowledge.embeddings"""
+        try:
+            for start in range(0, len(doc_ids), self.SQL_BATCH_SIZE):
+                batch = [
+                    (embeddings[i].tobytes(), int(doc_ids[i]))
+                    for i in range(start, min(start + self.SQL_BATCH_SIZE, len(doc_ids)))
+                ]
+                with self.db.transaction() as cursor:
+                    cursor.executemany('UPDATE knowledge SET embeddings = ? WHERE id = ?', batch)
+        except sqlite3.Error as e:
+            print(f"⚠️ Не удалось сохранить эмбеддинги: {e}")
+    
+    def _score_rows(self, segment, rows, query_vec, whole=False):
+        """Косинусное сходство запроса с выбранными строками сегмента"""
+        import numpy as np
         
-        return all_results[:limit]
+        if not len(rows):
+            return np.empty(0)
+        if not whole:
+            segment = segment[rows]
+        # Строки индекса нормированы, поэтому скалярное произведение - это косинусное сходство
+        return (segment @ query_vec.T).toarray().ravel()
     
-    def _text_search(self, query, category, min_confidence, limit):
-        """Традиционный текстовый поиск"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _build_category_rows(self, categories, offset=0, category_rows=None):
+        """Группировка номеров строк по категориям"""
+        import numpy as np
         
-        if category:
-            cursor.execute('''
-                SELECT * FROM knowledge 
-                WHERE category = ? AND confidence >= ?
-                ORDER BY usage_count DESC, confidence DESC
-                LIMIT ?
-            ''', (category, min_confidence, limit))
-        else:
-            cursor.execute('''
-                SELECT * FROM knowledge 
-                WHERE confidence >= ?
-                ORDER BY usage_count DESC, confidence DESC
-                LIMIT ?
-            ''', (min_confidence, limit))
+        grouped = defaultdict(list)
+        for position, category in enumerate(categories, offset):
+            grouped[category].append(position)
         
-        results = []
-        for row in cursor.fetchall():
-            results.append(self._row_to_dict(row))
+        category_rows = dict(category_rows or {})
+        for category, positions in grouped.items():
+            new_rows = np.array(positions, dtype=np.int64)
+            if category in category_rows:
+                new_rows = np.concatenate([category_rows[category], new_rows])
+            category_rows[category] = new_rows
+        return category_rows
+    
+    def _weight_rows(self, counts, idf):
+        """TF-IDF взвешивание и L2-нормировка строк с частотами терминов"""
+        import numpy as np
+        from sklearn.preprocessing import normalize
         
-        conn.close()
-        return results
+        weighted = counts.tocsr(copy=True).astype(np.float64)
+        weighted.data *= idf[weighted.indices]
+        return normalize(weighted, norm='l2', copy=False)
     
-    def _vector_search(self, query, category, limit):
-        """Векторный поиск с использованием TF-IDF"""
-        if self.vectors is None:
-            return []
+    def _load_vectors(self):
+        """Полная перестройка индекса (или загрузка актуального снимка с диска)"""
+        import numpy as np
         
         try:
-            # Преобразуем запрос в вектор
-            query_vec = self.vectorizer.transform([query])
+            # Поколение и документы читаются в одной транзакции,
+            # чтобы снимок соответствовал именно этому состоянию базы
+            # Сохраненный снимок открывается вне транзакции чтения:
+            # при загрузке может понадобиться запись эмбеддингов ANN
+            with self.db.snapshot() as cursor:
+                generation = self._get_generation(cursor)
+            if self._load_index_snapshot(generation):
+                return
             
-            # Вычисляем косинусное сходство
-            similarities = cosine_similarity(query_vec, self.vectors).flatten()
+            with self.db.snapshot() as cursor:
+                generation = self._get_generation(cursor)
+                cursor.execute("SELECT id, question, category FROM knowledge")
+                rows = cursor.fetchall()
             
-            # Получаем индексы наиболее похожих документов
-            top_indices = similarities.argsort()[-limit:][::-1]
+            doc_ids = np.array([row[0] for row in rows], dtype=np.int64)
+            documents = [row[1] for row in rows]
+            doc_categories = [sys.intern(row[2]) for row in rows]
+            category_rows = self._build_category_rows(doc_categories)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # Частоты терминов и частоты документов по всему корпусу
+            doc_freq = np.zeros(self.HASH_FEATURES, dtype=np.int32)
+            vectors = None
+            if documents:
+                counts = self._get_vectorizer().transform(documents)
+                doc_freq += np.bincount(counts.indices, minlength=self.HASH_FEATURES).astype(np.int32)
+                idf = np.log((1 + len(documents)) / (1 + doc_freq)) + 1
+                vectors = self._weight_rows(counts, idf)
             
-            results = []
-            for idx in top_indices:
-                if idx < len(self.doc_ids):
-                    cursor.execute('SELECT * FROM knowledge WHERE id = ?', (self.doc_ids[idx],))
-                    row = cursor.fetchone()
-                    if row:
-                        result = self._row_to_dict(row)
-                        result['similarity_score'] = float(similarities[idx])
-                        results.append(result)
+            ann = self._build_ann_index(vectors, doc_ids)
             
-            conn.close()
-            return results
+            # Снимок собирается целиком в стороне от читателей
+            snapshot = IndexSnapshot(
+                generation, self._get_vectorizer(), vectors, None, doc_ids, (),
+                doc_categories, (), category_rows, doc_freq, ann
+            )
+            
+            # Сохраненный набор сразу открывается через memmap,
+            # чтобы процесс не держал собственную копию матрицы
+            set_path = self._save_index_snapshot(snapshot)
+            mapped = self._map_saved_set(set_path)
+            if mapped:
+                snapshot = snapshot.replace(vectors=mapped['vectors'], base_ids=mapped['doc_ids'])
+            
+            # Публикация - одна замена ссылки; более новый снимок не перезаписывается
+            with self._index_lock:
+                current = self.index.generation
+                if current is not None and generation is not None and current > generation:
+                    return
+                self.index = snapshot
+            
+            if ann is not None:
+                self._report_ann_recall(snapshot)
             
         except Exception as e:
-            print(f"❌ Ошибка векторного поиска: {e}")
-            return []
+            print(f"❌ Ошибка загрузки векторов: {e}")
     
-    def _load_vectors(self):
-        """Загрузка векторных представлений"""
+    def _index_document(self, doc_id, question, category, generation):
+        """Инкрементальное добавление документа в индекс (публикацией нового снимка)
+        
+        В вызывающем потоке строка только дописывается в добавочный сегмент;
+        слияние с основным сегментом выполняет поток планировщика перестроек.
+        """
+        from scipy import sparse
+        
+        if not self._index_ready.is_set():
+            # Вставка не ждет прогрева: строку подхватит перестройка (дописыванием к снимку с диска)
+            self._update_vectors()
+            return
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            counts = self._get_vectorizer().transform([question])
             
-            cursor.execute("SELECT id, question FROM knowledge")
-            rows = cursor.fetchall()
+            with self._index_lock:
+                current = self.index
+                consistent = current.generation is not None and generation == current.generation + 1
+                
+                doc_freq = current.doc_freq.copy()
+                doc_freq[counts.indices] += 1
+                snapshot = current.replace(
+                    generation=generation if consistent else current.generation,
+                    doc_freq=doc_freq,
+                    delta_ids=current.delta_ids + (doc_id,),
+                    delta_categories=current.delta_categories + (sys.intern(category),)
+                )
+                # Снимок еще не опубликован, его можно дополнить
+                row = self._weight_rows(counts, snapshot.idf())
+                snapshot.delta = row if current.delta is None else sparse.vstack([current.delta, row], format='csr')
+                self.index = snapshot
             
-            if not rows:
-                self.vectors = None
+            if not consistent:
+                # База изменилась в обход этого индекса - нужна полная перестройка
+                self._update_vectors()
+            elif len(snapshot.delta_ids) >= self.DELTA_MERGE_THRESHOLD:
+                # Периодически сливаем добавленные строки с основным сегментом
+                self.reindexer.request_merge()
+                
+        except Exception as e:
+            print(f"❌ Ошибка индексации документа: {e}")
+            self._update_vectors()
+    
+    def _merge_delta(self):
+        """Слияние добавочного сегмента с основным (в потоке планировщика перестроек)
+        
+        Тяжелая часть - vstack, эмбеддинги ANN и запись набора файлов - идет вне блокировки;
+        строки, добавленные за это время, остаются в добавочном сегменте нового снимка.
+        """
+        import numpy as np
+        from scipy import sparse
+        
+        snapshot = self.index
+        merged_count = len(snapshot.delta_ids)
+        if snapshot.delta is None or merged_count < self.DELTA_MERGE_THRESHOLD:
+            return
+        
+        delta = snapshot.delta
+        merged_ids = list(snapshot.delta_ids)
+        if snapshot.ann_index is not None:
+            self._store_embeddings(merged_ids, snapshot.ann_index.extend(delta))
+        
+        merged = snapshot.replace(
+            vectors=delta if snapshot.vectors is None else sparse.vstack([snapshot.vectors, delta], format='csr'),
+            delta=None,
+            base_ids=np.concatenate([np.asarray(snapshot.base_ids, dtype=np.int64),
+                                     np.array(merged_ids, dtype=np.int64)]),
+            delta_ids=(),
+            base_categories=list(snapshot.base_categories) + list(snapshot.delta_categories),
+            delta_categories=(),
+            category_rows=self._build_category_rows(
+                snapshot.delta_categories, snapshot.base_count, snapshot.category_rows
+            )
+        )
+        
+        # Слитая матрица в памяти заменяется отображением нового набора файлов
+        set_path = self._save_index_snapshot(merged)
+        mapped = self._map_saved_set(set_path)
+        if mapped:
+            merged = merged.replace(vectors=mapped['vectors'], base_ids=mapped['doc_ids'])
+        
+        with self._index_lock:
+            current = self.index
+            if current.vectors is not snapshot.vectors or current.delta_ids[:merged_count] != snapshot.delta_ids:
+                # Индекс успели перестроить полностью - результат слияния устарел
                 return
+            remaining = current.delta_ids[merged_count:]
+            self.index = current.replace(
+                vectors=merged.vectors,
+                base_ids=merged.base_ids,
+                base_categories=merged.base_categories,
+                category_rows=merged.category_rows,
+                delta=current.delta[merged_count:] if remaining else None,
+                delta_ids=remaining,
+                delta_categories=current.delta_categories[merged_count:]
+            )
+        return True
+    
+    def _get_generation(self, cursor):
+        """Текущее поколение содержимого базы знаний"""
+        cursor.execute("SELECT value FROM kb_meta WHERE key = 'generation'")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def _load_index_snapshot(self, generation):
+        """Загрузка сохраненного индекса, если он соответствует поколению базы
+        
+        Строки, добавленные после сохранения (и только добавленные), дописываются
+        в добавочный сегмент вместо полной перестройки.
+        """
+        import numpy as np
+        
+        set_path = self._current_index_set()
+        if not set_path:
+            return False
+        
+        try:
+            snapshot = self._map_index_files(set_path, load_aux=True)
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать снимок индекса: {e}")
+            return False
+        
+        if snapshot is None or snapshot['generation'] is None or snapshot['generation'] > generation:
+            return False
+        
+        added = []
+        if snapshot['generation'] < generation:
+            base_ids = snapshot['doc_ids']
+            last_id = int(base_ids.max()) if len(base_ids) else 0
+            with self.db.snapshot() as cursor:
+                generation = self._get_generation(cursor)
+                cursor.execute("SELECT id, question, category FROM knowledge WHERE id > ? ORDER BY id",
+                               (last_id,))
+                added = cursor.fetchall()
+            # Каждая вставка увеличивает поколение на единицу: если разрыв больше,
+            # строки еще и изменялись или удалялись - тогда нужна полная перестройка
+            if generation - snapshot['generation'] != len(added):
+                return False
+        
+        ann = snapshot['ann_index']
+        built_ann = ann is None
+        if built_ann:
+            # Набор сохранен без ANN (например, в режиме exact): строим и дописываем в тот же набор
+            ann = self._build_ann_index(snapshot['vectors'], snapshot['doc_ids'])
+            if ann is not None:
+                try:
+                    self._write_ann_file(set_path, ann)
+                except OSError as e:
+                    print(f"⚠️ Не удалось сохранить ANN-индекс: {e}")
+        
+        doc_categories = snapshot['doc_categories']
+        index = IndexSnapshot(
+            generation, self._get_vectorizer(), snapshot['vectors'], None, snapshot['doc_ids'], (),
+            doc_categories, (), self._build_category_rows(doc_categories), snapshot['doc_freq'], ann
+        )
+        if added:
+            counts = self._get_vectorizer().transform([row[1] for row in added])
+            doc_freq = snapshot['doc_freq'].copy()
+            doc_freq += np.bincount(counts.indices, minlength=self.HASH_FEATURES).astype(np.int32)
+            index = index.replace(
+                doc_freq=doc_freq,
+                delta_ids=tuple(row[0] for row in added),
+                delta_categories=tuple(sys.intern(row[2]) for row in added)
+            )
+            index.delta = self._weight_rows(counts, index.idf())
+        with self._index_lock:
+            self.index = index
+        print(f"⚡ Индекс загружен с диска (поколение {generation}, документов: {index.doc_count}, "
+              f"дописано: {len(added)})")
+        if len(added) >= self.DELTA_MERGE_THRESHOLD:
+            self.reindexer.request_merge()
+        
+        if built_ann and ann is not None:
+            self._report_ann_recall(index)
+        return True
+    
+    def _current_index_set(self):
+        """Путь к набору файлов индекса, на который указывает файл-указатель"""
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                name = f.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+        set_path = os.path.join(self.index_dir, name)
+        return set_path if name and os.path.isdir(set_path) else None
+    
+    def _map_index_files(self, set_path, load_aux=False):
+        """Открытие набора файлов индекса: CSR-массивы и id документов через np.memmap"""
+        import numpy as np
+        from scipy import sparse
+        
+        with open(os.path.join(set_path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != self.INDEX_FORMAT_VERSION:
+            return None
+        
+        def open_array(name, dtype, length):
+            # Пустые файлы не отображаются в память
+            if not length:
+                return np.empty(0, dtype=dtype)
+            return np.memmap(os.path.join(set_path, name), dtype=dtype, mode='r', shape=(length,))
+        
+        rows, nnz = meta['rows'], meta['nnz']
+        doc_ids = open_array('doc_ids.bin', np.int64, rows)
+        vectors = None
+        if rows:
+            vectors = sparse.csr_matrix((
+                open_array('data.bin', meta['data_dtype'], nnz),
+                open_array('indices.bin', meta['index_dtype'], nnz),
+                open_array('indptr.bin', meta['index_dtype'], rows + 1)
+            ), shape=(rows, self.HASH_FEATURES), copy=False)
+        
+        snapshot = {'generation': meta['generation'], 'vectors': vectors, 'doc_ids': doc_ids}
+        if load_aux:
+            names = meta['category_names']
+            codes = np.fromfile(os.path.join(set_path, 'categories.bin'), dtype=np.int32) if rows else []
+            snapshot['doc_categories'] = [sys.intern(names[code]) for code in codes]
+            snapshot['doc_freq'] = np.fromfile(os.path.join(set_path, 'doc_freq.bin'), dtype=np.int32)
+            snapshot['ann_index'] = None
+            ann_path = os.path.join(set_path, 'ann.pkl')
+            if os.path.exists(ann_path):
+                with open(ann_path, 'rb') as f:
+                    snapshot['ann_index'] = pickle.load(f)
+        return snapshot
+    
+    def _save_index_snapshot(self, snapshot):
+        """Запись основного сегмента снимка в новый набор файлов и атомарное переключение указателя"""
+        import numpy as np
+        
+        generation, vectors, doc_ids = snapshot.generation, snapshot.vectors, snapshot.base_ids
+        doc_categories, doc_freq, ann_index = snapshot.base_categories, snapshot.doc_freq, snapshot.ann_index
+        set_path = None
+        tmp_path = None
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            set_path = tempfile.mkdtemp(dir=self.index_dir, prefix=f'g{generation}-')
             
-            self.doc_ids = [row[0] for row in rows]
-            documents = [row[1] for row in rows]
+            names = sorted(set(doc_categories))
+            codes = {name: code for code, name in enumerate(names)}
+            meta = {
+                'format_version': self.INDEX_FORMAT_VERSION,
+                'generation': generation,
+                'rows': vectors.shape[0] if vectors is not None else 0,
+                'nnz': int(vectors.nnz) if vectors is not None else 0,
+                'data_dtype': vectors.data.dtype.str if vectors is not None else '<f8',
+                'index_dtype': vectors.indices.dtype.str if vectors is not None else '<i4',
+                'category_names': names
+            }
             
-            # Обучение векторизатора и преобразование документов
-            self.vectors = self.vectorizer.fit_transform(documents)
+            if vectors is not None:
+                # indptr приводится к типу indices, иначе scipy скопирует массивы при открытии
+                vectors.data.tofile(os.path.join(set_path, 'data.bin'))
+                vectors.indices.tofile(os.path.join(set_path, 'indices.bin'))
+                vectors.indptr.astype(vectors.indices.dtype).tofile(os.path.join(set_path, 'indptr.bin'))
+            np.asarray(doc_ids, dtype=np.int64).tofile(os.path.join(set_path, 'doc_ids.bin'))
+            np.array([codes[c] for c in doc_categories], dtype=np.int32).tofile(os.path.join(set_path, 'categories.bin'))
+            np.asarray(doc_freq, dtype=np.int32).tofile(os.path.join(set_path, 'doc_freq.bin'))
+            if ann_index is not None:
+                self._write_ann_file(set_path, ann_index)
             
-            conn.close()
+            # Завершение набора, переключение указателя и очистка идут под межпроцессной
+            # блокировкой: иначе другой писатель удалит завершенный, но еще не опубликованный набор
+            with self._index_dir_lock():
+                previous = self._current_index_set()
+                if previous and self._set_generation(previous) > generation:
+                    # Другой процесс уже опубликовал более новый индекс
+                    shutil.rmtree(set_path, ignore_errors=True)
+                    return None
+                
+                # meta.json пишется последним: набор без него считается незавершенным
+                with open(os.path.join(set_path, 'meta.json'), 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False)
+                
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.index_path)),
+                                                prefix='.index_', suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(os.path.basename(set_path))
+                os.replace(tmp_path, self.index_path)
+                tmp_path = None
+                
+                self._remove_stale_index_sets(keep={set_path, previous})
+            return set_path
             
         except Exception as e:
-            print(f"❌ Ошибка загрузки векторов: {e}")
-            self.vectors = None
+            print(f"⚠️ Не удалось сохранить снимок индекса: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if set_path:
+                shutil.rmtree(set_path, ignore_errors=True)
+            return None
+    
+    @contextmanager
+    def _index_dir_lock(self):
+        """Эксклюзивная блокировка каталога наборов индекса между процессами и экземплярами"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(os.path.join(self.index_dir, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def _set_generation(self, set_path):
+        """Поколение завершенного набора файлов (-1, если набор не читается)"""
+        try:
+            with open(os.path.join(set_path, 'meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f).get('generation', -1)
+        except (OSError, ValueError):
+            return -1
+    
+    def _map_saved_set(self, set_path):
+        """Отображение только что сохраненного набора; при ошибке остается снимок в памяти"""
+        if not set_path:
+            return None
+        try:
+            return self._map_index_files(set_path)
+        except Exception as e:
+            print(f"⚠️ Не удалось открыть сохраненный индекс, используется копия в памяти: {e}")
+            return None
+    
+    def _write_ann_file(self, set_path, ann_index):
+        """Атомарная запись ANN-индекса в набор файлов (через временный файл и os.replace)"""
+        fd, tmp_path = tempfile.mkstemp(dir=set_path, prefix='.ann_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(ann_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, os.path.join(set_path, 'ann.pkl'))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    
+    def _remove_stale_index_sets(self, keep):
+        """Удаление завершенных наборов файлов, на которые больше никто не указывает
+        
+        Вызывается только под _index_dir_lock. Предыдущий набор сохраняется для процессов,
+        которые еще открывают его; уже отображенные в память файлы остаются доступными и после удаления.
+        """
+        keep = {os.path.abspath(path) for path in keep if path}
+        for name in os.listdir(self.index_dir):
+            path = os.path.abspath(os.path.join(self.index_dir, name))
+            if path not in keep and os.path.exists(os.path.join(path, 'meta.json')):
+                shutil.rmtree(path, ignore_errors=True)
     
     def _update_vectors(self):
-        """Обновление векторных представлений"""
-        threading.Thread(target=self._load_vectors, daemon=True).start()
+        """Запрос фоновой полной перестройки векторных представлений"""
+        self.reindexer.notify()
+    
+    def get_index_status(self):
+        """Поколение опубликованного индекса и число ожидающих перестройки изменений"""
+        with self.db.snapshot() as cursor:
+            database_generation = self._get_generation(cursor)
+        indexed_generation = self.indexed_generation
+        index = self.index
+        status = {
+            'indexed_generation': indexed_generation,
+            'database_generation': database_generation,
+            'generation_lag': (database_generation - indexed_generation) if indexed_generation is not None else None,
+            'documents': index.doc_count,
+            'delta_documents': len(index.delta_ids)
+        }
+        status.update(self.reindexer.stats())
+        return status
     
     def _merge_results(self, text_results, vector_results, query):
         """Объединение и ранжирование результатов"""
@@ -339,7 +2588,7 @@ class AdvancedKnowledgeDatabase:
         # Добавляем текстовые результаты
         for result in text_results:
             result_id = result['id']
-            result['score'] = result.get('confidence', 0.5) * 0.3
+            result['score'] = result.get('text_score', 0) * 0.3
             merged[result_id] = result
         
         # Добавляем векторные результаты
@@ -358,150 +2607,234 @@ class AdvancedKnowledgeDatabase:
         
         return results
     
-    def _row_to_dict(self, row):
-        """Преобразование строки БД в словарь"""
-        return {
-            'id': row[0],
-            'question': row[1],
-            'answer': row[2],
-            'category': row[3],
-            'intent': row[4],
-            'tags': json.loads(row[5]) if row[5] else [],
-            'confidence': row[6],
-            'usage_count': row[7],
-            'success_rate': row[8],
-            'created_at': row[9],
-            'updated_at': row[10],
-            'source': row[11]
-        }
+    def _row_to_entry(self, row):
+        """Преобразование строки RANKING_COLUMNS в KnowledgeEntry (ответ загружается лениво)"""
+        usage_count, success_rate = self._apply_pending_usage(row[0], row[6], row[7])
+        return KnowledgeEntry(
+            row[0], row[1], row[2], row[3], row[4], row[5], usage_count, success_rate,
+            row[8], row[9], row[10], answer_loader=self._load_answer
+        )
+    
+    def _load_answer(self, knowledge_id):
+        """Текст ответа одной записи"""
+        row = self.db.execute('SELECT answer FROM knowledge WHERE id = ?', (knowledge_id,)).fetchone()
+        return row[0] if row else ''
+    
+    def _apply_pending_usage(self, knowledge_id, usage_count, success_rate):
+        """Учет еще не записанных в базу событий использования"""
+        for success in self.usage_buffer.pending(knowledge_id):
+            usage_count += 1
+            success_rate = min(1.0, success_rate + 0.05) if success else max(0.0, success_rate - 0.1)
+        return usage_count, success_rate
     
     def update_usage(self, knowledge_id, success=True):
-        """Обновление статистики использования"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if success:
-            cursor.execute('''
-                UPDATE knowledge 
-                SET usage_count = usage_count + 1,
-                    success_rate = MIN(1.0, success_rate + 0.05),
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (knowledge_id,))
-        else:
-            cursor.execute('''
+        """Обновление статистики использования (запись откладывается в буфер)"""
+        self.usage_buffer.add(knowledge_id, bool(success))
+    
+    def flush_usage(self):
+        """Немедленная запись накопленной статистики использования"""
+        self.usage_buffer.flush()
+    
+    def _flush_usage(self, batch):
+        """Пакетная запись событий использования в порядке их поступления"""
+        rows = [(success, knowledge_id) for knowledge_id, events in batch.items() for success in events]
+        with self.db.transaction() as cursor:
+            cursor.executemany('''
                 UPDATE knowledge 
                 SET usage_count = usage_count + 1,
-                    success_rate = MAX(0.0, success_rate - 0.1),
+                    success_rate = CASE WHEN ? THEN MIN(1.0, success_rate + 0.05)
+                                       ELSE MAX(0.0, success_rate - 0.1) END,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
-            ''', (knowledge_id,))
-        
-        conn.commit()
-        conn.close()
+            ''', rows)
+    
+    def log_conversation(self, user_id, message, response, intent, confidence, context_hash):
+        """Асинхронное сохранение обмена сообщениями в таблицу conversations"""
+        return self.conversation_writer.submit(
+            # Время фиксируется при постановке в очередь, в формате CURRENT_TIMESTAMP (UTC)
+            (user_id, message, response, intent, confidence, context_hash,
+             time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+        )
+    
+    def _write_conversations(self, records):
+        """Пакетная вставка записей журнала разговоров"""
+        with self.db.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO conversations (user_id, message, response, intent, confidence, context_hash, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', records)
     
     def get_statistics(self):
-        """Получение статистики базы знаний"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM knowledge")
-        total = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM knowledge WHERE source = 'web'")
-        web_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(DISTINCT category) FROM knowledge")
-        categories_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT SUM(usage_count) FROM knowledge")
-        total_usage = cursor.fetchone()[0] or 0
-        
-        cursor.execute("SELECT category, COUNT(*) FROM knowledge GROUP BY category")
-        categories = dict(cursor.fetchall())
-        
-        conn.close()
+        """Получение статистики базы знаний из поддерживаемых триггерами счетчиков"""
+        with self.db.snapshot() as cursor:
+            cursor.execute("SELECT key, value FROM kb_meta")
+            counters = dict(cursor.fetchall())
+            
+            cursor.execute("SELECT category, entries FROM knowledge_category_stats WHERE entries > 0")
+            categories = dict(cursor.fetchall())
         
         return {
-            'total_entries': total,
-            'web_entries': web_count,
-            'categories_count': categories_count,
-            'total_usage': total_usage,
-            'categories': categories
+            'total_entries': counters.get('total_entries', 0),
+            'web_entries': counters.get('web_entries', 0),
+            'categories_count': len(categories),
+            'total_usage': counters.get('total_usage', 0) + self.usage_buffer.pending_count(),
+            'categories': categories,
+            'duplicates_merged': self.duplicates_merged,
+            'search_cache': self.search_cache.stats(),
+            'conversation_log': self.conversation_writer.stats(),
+            'index': self.get_index_status()
         }
     
-    def export_knowledge(self, format='json'):
-        """Экспорт знаний"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def iter_knowledge(self):
+        """Потоковое чтение всех записей базы знаний порциями по id
         
-        cursor.execute("SELECT * FROM knowledge ORDER BY usage_count DESC")
-        rows = cursor.fetchall()
+        Каждая порция читается отдельной короткой транзакцией: медленный клиент
+        экспорта не держит снимок базы и не мешает контрольным точкам WAL.
+        """
+        self.flush_usage()
+        last_id = 0
+        while True:
+            with self.db.snapshot() as cursor:
+                cursor.execute('''
+                    SELECT id, question, answer, category, intent, tags, confidence,
+                           usage_count, success_rate, created_at, source
+                    FROM knowledge WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, self.EXPORT_CHUNK_SIZE))
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for row in rows:
+                yield {
+                    'id': row[0],
+                    'question': row[1],
+                    'answer': row[2],
+                    'category': row[3],
+                    'intent': row[4],
+                    'tags': json.loads(row[5]) if row[5] else [],
+                    'confidence': row[6],
+                    'usage_count': row[7],
+                    'success_rate': row[8],
+                    'created_at': row[9],
+                    'source': row[10]
+                }
+    
+    def iter_export_ndjson(self):
+        """NDJSON-экспорт блоками байтов по EXPORT_CHUNK_SIZE записей"""
+        lines = []
+        for item in self.iter_knowledge():
+            lines.append(json.dumps(item, ensure_ascii=False))
+            if len(lines) >= self.EXPORT_CHUNK_SIZE:
+                yield ('\n'.join(lines) + '\n').encode('utf-8')
+                lines = []
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+    
+    def export_knowledge(self, format='ndjson', compress=False):
+        """Потоковый экспорт знаний в файл (ndjson, json или txt), память не зависит от размера базы"""
+        extension = {'ndjson': 'ndjson', 'json': 'json'}.get(format, 'txt')
+        filename = f"knowledge_export_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
+        if compress:
+            filename += '.gz'
+        opener = gzip.open if compress else open
         
-        knowledge_data = []
-        for row in rows:
-            knowledge_data.append({
-                'id': row[0],
-                'question': row[1],
-                'answer': row[2],
-                'category': row[3],
-                'intent': row[4],
-                'tags': json.loads(row[5]) if row[5] else [],
-                'usage_count': row[7],
-                'success_rate': row[8],
-                'created_at': row[9]
-            })
-        
-        conn.close()
-        
-        if format == 'json':
-            filename = f"knowledge_export_{datetime.now().strftime('%Y%m%d_%H%M')}.json"
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(knowledge_data, f, ensure_ascii=False, indent=2)
-        else:
-            filename = f"knowledge_export_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
-            with open(filename, 'w', encoding='utf-8') as f:
+        with opener(filename, 'wt', encoding='utf-8') as f:
+            if format == 'ndjson':
+                for chunk in self.iter_export_ndjson():
+                    f.write(chunk.decode('utf-8'))
+            elif format == 'json':
+                # JSON-массив пишется по элементам, без сборки списка в памяти
+                f.write('[')
+                for i, item in enumerate(self.iter_knowledge()):
+                    f.write(',\n' if i else '\n')
+                    f.write(json.dumps(item, ensure_ascii=False, indent=2))
+                f.write('\n]')
+            else:
                 f.write("ЭКСПОРТ БАЗЫ ЗНАНИЙ AI ASSISTANT\n")
                 f.write("=" * 50 + "\n\n")
                 
-                for item in knowledge_data:
+                for item in self.iter_knowledge():
                     f.write(f"ВОПРОС: {item['question']}\n")
                     f.write(f"ОТВЕТ: {item['answer'][:200]}...\n")
                     f.write(f"КАТЕГОРИЯ: {item['category']} | ИСПОЛЬЗОВАНИЙ: {item['usage_count']}\n")
                     f.write("-" * 40 + "\n")
         
         return filename
+    
+    def close(self):
+        """Закрытие соединений с базой данных (с записью накопленной статистики и журнала)"""
+        self.reindexer.close()
+        self.usage_buffer.close()
+        self.conversation_writer.close()
+        self.db.close_all()
 
 class EnhancedWebSearch:
     """Улучшенная система веб-поиска с кэшированием"""
     
-    def __init__(self):
+    # Таймауты отдельных движков и общий срок ответа всего поиска (секунды)
+    ENGINE_TIMEOUTS = {'duckduckgo': 6.0, 'wikipedia': 5.0}
+    DEFAULT_ENGINE_TIMEOUT = 5.0
+    SEARCH_DEADLINE = 7.0
+    SEARCH_WORKERS = 8
+    # Сроки жизни кэша по доменам запроса, в днях: (мягкий, жесткий).
+    # До мягкого срока запись свежая; до жесткого отдается сразу и обновляется в фоне
+    CACHE_TTLS = {
+        'general': (1, 7),
+        'programming': (7, 30),
+        'science': (14, 60),
+        'technology': (1, 7),
+        'education': (7, 30),
+        'business': (1, 3)
+    }
+    REFRESH_WORKERS = 2
+    MEMORY_CACHE_SIZE = 256
+    CACHE_HITS_FLUSH_INTERVAL = 5.0
+    CACHE_HITS_FLUSH_THRESHOLD = 200
+    
+    def __init__(self, knowledge_db=None, cache_ttls=None):
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         })
-        self.knowledge_db = AdvancedKnowledgeDatabase()
+        # Хранилище передается извне, чтобы не держать второй экземпляр индекса
+        self.knowledge_db = knowledge_db if knowledge_db is not None else AdvancedKnowledgeDatabase()
+        # Движки опрашиваются параллельно; пул общий для всех запросов
+        self.executor = ThreadPoolExecutor(max_workers=self.SEARCH_WORKERS, thread_name_prefix='web-search')
+        # Кэш в памяти перед таблицей web_cache: хэш запроса -> (результаты, время создания)
+        self.memory_cache = LRUCache(self.MEMORY_CACHE_SIZE)
+        self.cache_ttls = dict(self.CACHE_TTLS, **(cache_ttls or {}))
+        # Фоновые обновления устаревших записей идут в отдельном пуле,
+        # чтобы не занимать потоки, которые сами опрашивают движки
+        self.refresh_executor = ThreadPoolExecutor(max_workers=self.REFRESH_WORKERS, thread_name_prefix='web-refresh')
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.cache_hits = WriteBehindBuffer(
+            self._flush_cache_hits, self.CACHE_HITS_FLUSH_INTERVAL, self.CACHE_HITS_FLUSH_THRESHOLD,
+            name='web-cache-hits'
+        )
     
     def intelligent_search(self, query, max_results=5, use_cache=True):
         """Интеллектуальный поиск с анализом контекста и кэшированием"""
         print(f"🔍 Умный поиск: '{query}'")
         
-        # Проверяем кэш
-        if use_cache:
-            cached_results = self._get_cached_results(query)
-            if cached_results:
-                print("✅ Используем кэшированные результаты")
-                return cached_results
-        
         # Анализируем тип запроса
         query_type = self._analyze_query_type(query)
-        search_strategy = self._get_search_strategy(query_type)
         
-        # Выполняем поиск
-        results = self._execute_multi_engine_search(query, search_strategy, max_results)
+        # Проверяем кэш: устаревшая запись отдается сразу и обновляется в фоне
+        if use_cache:
+            cached = self._get_cached_results(query, query_type['domain'])
+            if cached:
+                cached_results, fresh = cached
+                if fresh:
+                    print("✅ Используем кэшированные результаты")
+                else:
+                    print("♻️ Используем устаревшие результаты, обновляем в фоне")
+                    self._schedule_refresh(query, query_type, max_results)
+                return cached_results
         
-        # Обогащаем результаты
-        enriched_results = self._enrich_results(results, query_type)
+        enriched_results = self._live_search(query, query_type, max_results)
         
         # Сохраняем в кэш
         self._cache_results(query, enriched_results)
@@ -511,6 +2844,43 @@ class EnhancedWebSearch:
         
         return enriched_results
     
+    def _live_search(self, query, query_type, max_results):
+        """Поиск по движкам стратегии с обогащением результатов"""
+        search_strategy = self._get_search_strategy(query_type)
+        
+        # Выполняем поиск
+        results = self._execute_multi_engine_search(query, search_strategy, max_results)
+        
+        # Обогащаем результаты
+        return self._enrich_results(results, query_type)
+    
+    def _schedule_refresh(self, query, query_type, max_results):
+        """Фоновое обновление устаревшей записи кэша (не более одного на запрос)"""
+        query_hash = self._cache_key(query)
+        with self._refresh_lock:
+            if query_hash in self._refreshing:
+                return
+            self._refreshing.add(query_hash)
+        try:
+            self.refresh_executor.submit(self._refresh_cached, query_hash, query, query_type, max_results)
+        except RuntimeError:
+            # Пул уже остановлен при завершении работы
+            with self._refresh_lock:
+                self._refreshing.discard(query_hash)
+    
+    def _refresh_cached(self, query_hash, query, query_type, max_results):
+        """Повторный поиск и замена записи кэша; пустой ответ не вытесняет старые данные"""
+        try:
+            results = self._live_search(query, query_type, max_results)
+            if results:
+                self._cache_results(query, results)
+                self.refreshes += 1
+        except Exception as e:
+            print(f"❌ Ошибка фонового обновления кэша: {e}")
+        finally:
+            with self._refresh_lock:
+                self._refreshing.discard(query_hash)
+    
     def _analyze_query_type(self, query):
         """Глубокий анализ типа запроса"""
         query_lower = query.lower()
@@ -554,33 +2924,84 @@ class EnhancedWebSearch:
         
         return analysis
     
-    def _execute_multi_engine_search(self, query, search_strategy, max_results):
-        """Выполнение поиска по нескольким движкам"""
-        all_results = []
+    def _execute_multi_engine_search(self, query, search_strategy, max_results, deadline=None):
+        """Параллельный поиск по нескольким движкам с общим сроком ответа
         
-        for engine in search_strategy[:2]:  # Используем первые 2 движка из стратегии
-            try:
-                if engine == 'duckduckgo':
-                    results = self._duckduckgo_search(query, max_results)
-                elif engine == 'wikipedia':
-                    results = self._wikipedia_search(query, max_results)
-                elif engine == 'stackoverflow':
-                    results = self._stackoverflow_search(query, max_results)
-                else:
-                    results = self._fallback_search(query, max_results)
-                
-                if results:
-                    all_results.extend(results)
-                    
-            except Exception as e:
-                print(f"❌ Ошибка поиска в {engine}: {e}")
-                continue
+        Результаты собираются в порядке стратегии; по истечении срока возвращается то,
+        что успело прийти, а еще не начатые запросы отменяются.
+        """
+        engines = search_strategy[:2]  # Используем первые 2 движка из стратегии
+        deadline_at = time.monotonic() + (self.SEARCH_DEADLINE if deadline is None else deadline)
+        futures = {
+            self.executor.submit(self._run_engine, engine, query, max_results): engine
+            for engine in engines
+        }
+        results_by_engine = {}
+        pending = set(futures)
+        timed_out = False
+        
+        while pending:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                engine = futures[future]
+                try:
+                    results_by_engine[engine] = future.result()
+                except Exception as e:
+                    print(f"❌ Ошибка поиска в {engine}: {e}")
             
+            # Первые по приоритету движки уже дали достаточно - остальных не ждем
+            if self._collect_engine_results(engines, results_by_engine, max_results, complete_only=True):
+                break
+        
+        for future in pending:
+            future.cancel()
+        if timed_out:
+            print(f"⚠️ Срок поиска истек, не дождались: {', '.join(futures[f] for f in pending)}")
+        
+        return self._collect_engine_results(engines, results_by_engine, max_results)
+    
+    def _collect_engine_results(self, engines, results_by_engine, max_results, complete_only=False):
+        """Объединение результатов в порядке стратегии
+        
+        С complete_only список возвращается, только если его уже не изменят
+        более приоритетные движки, которые еще не ответили.
+        """
+        all_results = []
+        for engine in engines:
+            if engine not in results_by_engine:
+                if complete_only:
+                    return None
+                continue
+            all_results.extend(results_by_engine[engine] or [])
             if len(all_results) >= max_results:
                 break
         
+        if complete_only and len(all_results) < max_results:
+            return None
         return all_results[:max_results]
     
+    def _run_engine(self, engine, query, max_results):
+        """Запрос к одному движку с его собственным таймаутом"""
+        timeout = self.ENGINE_TIMEOUTS.get(engine, self.DEFAULT_ENGINE_TIMEOUT)
+        if engine == 'duckduckgo':
+            return self._duckduckgo_search(query, max_results, timeout)
+        elif engine == 'wikipedia':
+            return self._wikipedia_search(query, max_results, timeout)
+        elif engine == 'stackoverflow':
+            return self._stackoverflow_search(query, max_results)
+        else:
+            return self._fallback_search(query, max_results)
+    
+    def close(self):
+        """Остановка пула поиска без ожидания зависших запросов и запись счетчиков кэша"""
+        self.refresh_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.cache_hits.close()
+    
     def _enrich_results(self, results, query_type):
         """Обогащение результатов дополнительной информацией"""
         enriched = []
@@ -654,58 +3075,83 @@ class EnhancedWebSearch:
         
         return snippet
     
-    def _get_cached_results(self, query):
-        """Получение результатов из кэш"""
+    @staticmethod
+    def _cache_key(query):
+        """Ключ кэша по нормализованной форме запроса (регистр, пробелы, финальные знаки)"""
+        return hashlib.md5(AdvancedKnowledgeDatabase.normalize_query(query).encode()).hexdigest()
+    
+    def _get_cached_results(self, query, domain='general'):
+        """Получение результатов из кэша: сначала память, затем таблица web_cache
+        
+        Возвращает (результаты, свежесть) или None, если записи нет, она пуста или старше жесткого срока.
+        """
         try:
-            query_hash = hashlib.md5(query.encode()).hexdigest()
+            query_hash = self._cache_key(query)
+            soft_ttl, hard_ttl = self.cache_ttls.get(domain, self.cache_ttls['general'])
             
-            conn = sqlite3.connect(self.knowledge_db.db_path)
-            cursor = conn.cursor()
+            cached = self.memory_cache.get(query_hash)
+            if cached is None:
+                row = self.knowledge_db.db.execute('''
+                    SELECT results, julianday('now') - julianday(created_at) FROM web_cache 
+                    WHERE query_hash = ? AND created_at > datetime('now', ?)
+                ''', (query_hash, f'-{hard_ttl} days')).fetchone()
+                if not row:
+                    return None
+                cached = (json.loads(row[0]), time.time() - row[1] * 86400)
+                self.memory_cache.put(query_hash, cached)
             
-            cursor.execute('''
-                SELECT results FROM web_cache 
-                WHERE query_hash = ? AND created_at > datetime('now', '-7 days')
-            ''', (query_hash,))
+            age_days = (time.time() - cached[1]) / 86400
+            # Пустой список (например, записанный раньше) считается промахом
+            if age_days >= hard_ttl or not cached[0]:
+                return None
             
-            row = cursor.fetchone()
-            if row:
-                # Обновляем счетчик использования
-                cursor.execute('''
-                    UPDATE web_cache SET usage_count = usage_count + 1 
-                    WHERE query_hash = ?
-                ''', (query_hash,))
-                conn.commit()
-                
-                results = json.loads(row[0])
-                conn.close()
-                return results
+            fresh = age_days < soft_ttl
+            if not fresh:
+                self.stale_hits += 1
             
-            conn.close()
-            return None
+            # Счетчик использования обновляется отложенно, пакетами
+            self.cache_hits.add(query_hash, 1)
+            return [dict(result) for result in cached[0]], fresh
             
         except Exception as e:
             print(f"❌ Ошибка доступа к кэшу: {e}")
             return None
     
+    def _flush_cache_hits(self, batch):
+        """Пакетная запись накопленных попаданий в кэш"""
+        with self.knowledge_db.db.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE web_cache SET usage_count = usage_count + ? 
+                WHERE query_hash = ?
+            ''', [(len(hits), query_hash) for query_hash, hits in batch.items()])
+    
     def _cache_results(self, query, results):
-        """Сохранение результатов в кэш"""
+        """Сохранение результатов в кэш (пустые результаты не кэшируются)"""
+        if not results:
+            return
         try:
-            query_hash = hashlib.md5(query.encode()).hexdigest()
-            
-            conn = sqlite3.connect(self.knowledge_db.db_path)
-            cursor = conn.cursor()
+            query_hash = self._cache_key(query)
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO web_cache (query_hash, query_text, results)
-                VALUES (?, ?, ?)
-            ''', (query_hash, query, json.dumps(results, ensure_ascii=False)))
+            with self.knowledge_db.db.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR REPLACE INTO web_cache (query_hash, query_text, results)
+                    VALUES (?, ?, ?)
+                ''', (query_hash, query, json.dumps(results, ensure_ascii=False)))
             
-            conn.commit()
-            conn.close()
+            self.memory_cache.put(query_hash, ([dict(result) for result in results], time.time()))
             
         except Exception as e:
             print(f"❌ Ошибка сохранения в кэш: {e}")
     
+    def cache_statistics(self):
+        """Статистика кэша веб-поиска в памяти и отложенных счетчиков"""
+        stats = self.memory_cache.stats()
+        stats['pending_hits'] = self.cache_hits.pending_count()
+        stats['stale_hits'] = self.stale_hits
+        stats['refreshes'] = self.refreshes
+        stats['refreshing'] = len(self._refreshing)
+        return stats
+    
     def _save_to_knowledge_base(self, query, results):
         """Сохранение полезных результатов в базу знаний"""
         try:
@@ -731,7 +3177,7 @@ class EnhancedWebSearch:
         ]
         return [word for word in words if word not in stop_words][:5]
     
-    def _duckduckgo_search(self, query, max_results):
+    def _duckduckgo_search(self, query, max_results, timeout=10):
         """Поиск через DuckDuckGo"""
         try:
             url = "https://api.duckduckgo.com/"
@@ -742,7 +3188,7 @@ class EnhancedWebSearch:
                 'skip_disambig': '1'
             }
             
-            response = self.session.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=timeout)
             data = response.json()
             
             results = []
@@ -760,7 +3206,7 @@ class EnhancedWebSearch:
             print(f"❌ Ошибка DuckDuckGo: {e}")
             return []
     
-    def _wikipedia_search(self, query, max_results):
+    def _wikipedia_search(self, query, max_results, timeout=8):
         """Поиск в Wikipedia"""
         try:
             # Упрощенный поиск через API Wikipedia
@@ -769,7 +3215,7 @@ class EnhancedWebSearch:
                 return []
                 
             url = f"https://ru.wikipedia.org/api/rest_v1/page/summary/{urllib.parse.quote(clean_query)}"
-            response = self.session.get(url, timeout=8)
+            response = self.session.get(url, timeout=timeout)
             
             if response.status_code == 200:
                 data = response.json()
@@ -836,10 +3282,14 @@ class EnhancedWebSearch:
 class DeepSeekLevelAI:
     """AI-ассистент уровня DeepSeek с расширенными возможностями"""
     
+    CONTEXT_CACHE_SIZE = 10000  # число пользователей, для которых помнится цепочка контекста
+    
     def __init__(self):
         self.knowledge_db = AdvancedKnowledgeDatabase()
-        self.web_search = EnhancedWebSearch()
+        self.web_search = EnhancedWebSearch(self.knowledge_db)
         self.conversation_context = []
+        # user_id -> хэш цепочки сообщений; user_id задает клиент, поэтому размер ограничен
+        self.context_hashes = LRUCache(self.CONTEXT_CACHE_SIZE)
         self.user_profiles = {}
         self.learning_mode = True
         
@@ -859,12 +3309,24 @@ class DeepSeekLevelAI:
         # Анализ запроса
         analysis = self._analyze_query(user_message)
         
+        response_data, source = self._find_response(user_message, analysis)
+        formatted_response = self._format_response(response_data, analysis, source)
+        
+        # Журнал пишется в фоне и не задерживает ответ
+        self.knowledge_db.log_conversation(
+            user_id, user_message, formatted_response, analysis['intent'],
+            response_data.get('confidence', 0.5), self._next_context_hash(user_id, user_message)
+        )
+        return formatted_response
+    
+    def _find_response(self, user_message, analysis):
+        """Поиск ответа: база знаний, затем веб-поиск, затем генерация"""
         # Поиск в базе знаний
         kb_response = self._search_knowledge_base(user_message, analysis)
         
         if kb_response and kb_response.get('confidence', 0) > 0.8:
             self.stats['knowledge_base_hits'] += 1
-            return self._format_response(kb_response, analysis, 'knowledge_base')
+            return kb_response, 'knowledge_base'
         
         # Веб-поиск
         self.stats['web_searches'] += 1
@@ -872,11 +3334,19 @@ class DeepSeekLevelAI:
         
         if web_response:
             self.stats['successful_responses'] += 1
-            return self._format_response(web_response, analysis, 'web_search')
+            return web_response, 'web_search'
         
         # Генерация ответа
-        generated_response = self._generate_response(user_message, analysis)
-        return self._format_response(generated_response, analysis, 'generated')
+        return self._generate_response(user_message, analysis), 'generated'
+    
+    def _next_context_hash(self, user_id, user_message):
+        """Хэш контекста: цепочка из предыдущего хэша пользователя и нового сообщения"""
+        previous = self.context_hashes.get(user_id, '')
+        context_hash = hashlib.sha1(
+            f"{previous}|{AdvancedKnowledgeDatabase.normalize_query(user_message)}".encode('utf-8')
+        ).hexdigest()
+        self.context_hashes.put(user_id, context_hash)
+        return context_hash
     
     def _analyze_query(self, query):
         """Глубокий анализ запроса"""
@@ -998,15 +3468,20 @@ class DeepSeekLevelAI:
     
     def _search_knowledge_base(self, query, analysis):
         """Поиск в базе знаний"""
+        # 'general' означает, что предметная область не определена
+        category = analysis['domain'] if analysis['domain'] != 'general' else None
+        
         results = self.knowledge_db.search_knowledge(
             query, 
-            category=analysis['domain'],
+            category=category,
             min_confidence=0.5,
-            limit=3
+            limit=3,
+            fetch_answers=False
         )
         
         if results:
             best_match = results[0]
+            self.knowledge_db.load_answers([best_match])
             self.knowledge_db.update_usage(best_match['id'], True)
             return best_match
         
@@ -1141,15 +3616,51 @@ class DeepSeekLevelAI:
         return {
             'ai_stats': self.stats,
             'knowledge_base_stats': db_stats,
+            'web_cache_stats': self.web_search.cache_statistics(),
             'conversation_context_count': len(self.conversation_context)
         }
     
-    def export_knowledge(self, format='json'):
+    def export_knowledge(self, format='ndjson', compress=False):
         """Экспорт знаний"""
-        return self.knowledge_db.export_knowledge(format)
+        return self.knowledge_db.export_knowledge(format, compress)
+    
+    def shutdown(self):
+        """Корректное завершение работы"""
+        self.web_search.close()
+        self.knowledge_db.close()
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP-сервер с фиксированным пулом потоков
+    
+    Долгий запрос (потоковый /export) не блокирует остальных клиентов, а постоянные
+    потоки пула переиспользуют свои соединения SQLite вместо открытия нового на каждый запрос.
+    """
+    
+    def __init__(self, server_address, handler_class, workers=HTTP_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+    
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_thread, request, client_address)
+    
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        """Закрытие сокета; ожидающие запросы отменяются, выполняющиеся дорабатывают"""
+        super().server_close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
 
 class AdvancedAIHandler(BaseHTTPRequestHandler):
-    ai = DeepSeekLevelAI()
+    ai = None  # создается в main(), а не при импорте модуля
+    timeout = HTTP_TIMEOUT  # медленный клиент не занимает поток пула бесконечно
+    started = None  # момент запуска процесса для метрики времени до первого ответа
+    _first_answer_lock = threading.Lock()
     
     def do_GET(self):
         """Обработка GET запросов"""
@@ -1157,7 +3668,7 @@ class AdvancedAIHandler(BaseHTTPRequestHandler):
             self._serve_advanced_interface()
         elif self.path == '/stats':
             self._serve_stats()
-        elif self.path == '/export':
+        elif urllib.parse.urlparse(self.path).path == '/export':
             self._export_knowledge()
         elif self.path == '/api/knowledge/count':
             self._serve_knowledge_count()
@@ -1608,15 +4119,14 @@ class AdvancedAIHandler(BaseHTTPRequestHandler):
                     }
                 }
                 
-                async function exportKnowledge() {
-                    try {
-                        const response = await fetch('/export');
-                        const data = await response.json();
-                        alert('✅ База знаний экспортирована: ' + data.filename);
-                    } catch (error) {
-                        alert('❌ Ошибка экспорта');
-                        console.error('Error:', error);
-                    }
+                function exportKnowledge() {
+                    // Браузер сохраняет поток сразу в файл, не собирая его в памяти
+                    const link = document.createElement('a');
+                    link.href = '/export?gzip=1';
+                    link.download = '';
+                    document.body.appendChild(link);
+                    link.click();
+                    link.remove();
                 }
                 
                 async function showStats() {
@@ -1666,8 +4176,9 @@ class AdvancedAIHandler(BaseHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data.decode('utf-8'))
             message = data.get('message', '')
+            user_id = str(data.get('user_id') or 'default')
             
-            response = self.ai.process_query(message)
+            response = self.ai.process_query(message, user_id)
             
             self.send_response(200)
             self.send_header('Content-type', 'application/json; charset=utf-8')
@@ -1675,11 +4186,25 @@ class AdvancedAIHandler(BaseHTTPRequestHandler):
             self.end_headers()
             
             self.wfile.write(json.dumps({"response": response}).encode('utf-8'))
+            self._report_first_answer()
             
         except Exception as e:
             print(f"❌ Ошибка обработки чата: {e}")
             self.send_error(500, f"Error: {str(e)}")
     
+    def _report_first_answer(self):
+        """Метрика запуска: время от старта процесса до первого отвеченного запроса"""
+        cls = AdvancedAIHandler
+        with cls._first_answer_lock:
+            if cls.started is None:
+                return
+            elapsed = time.perf_counter() - cls.started
+            cls.started = None
+        print(f"⏱️ Первый ответ через {elapsed * 1000:.0f} мс после запуска "
+              f"(цель: {STARTUP_TARGET_SECONDS * 1000:.0f} мс)")
+        if elapsed > STARTUP_TARGET_SECONDS:
+            print("⚠️ Время до первого ответа превышает целевое")
+    
     def _serve_stats(self):
         """Отдача статистики"""
         stats = self.ai.get_statistics()
@@ -1701,15 +4226,40 @@ class AdvancedAIHandler(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps({"count": stats['total_entries']}).encode('utf-8'))
     
     def _export_knowledge(self):
-        """Экспорт базы знаний"""
-        filename = self.ai.export_knowledge()
+        """Потоковая выгрузка базы знаний в NDJSON (chunked transfer encoding, опционально gzip)"""
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        compress = params.get('gzip', ['0'])[0] in ('1', 'true')
+        filename = f"knowledge_export_{datetime.now().strftime('%Y%m%d_%H%M')}.ndjson"
         
+        # Chunked-кодирование есть только в HTTP/1.1; соединение закрывается после ответа
+        self.protocol_version = 'HTTP/1.1'
+        self.close_connection = True
         self.send_response(200)
-        self.send_header('Content-type', 'application/json')
+        if compress:
+            filename += '.gz'
+            self.send_header('Content-type', 'application/gzip')
+        else:
+            self.send_header('Content-type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
         self.end_headers()
         
-        response = {"status": "success", "filename": filename}
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        try:
+            for chunk in self.ai.knowledge_db.iter_export_ndjson():
+                self._write_chunk(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                self._write_chunk(compressor.flush())
+            self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # Заголовки уже отправлены: обрываем ответ без завершающего блока
+            print(f"❌ Ошибка потокового экспорта: {e}")
+    
+    def _write_chunk(self, data):
+        """Запись одного блока chunked-ответа"""
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
     
     def _handle_learning(self):
         """Обработка запросов на обучение"""
@@ -1736,6 +4286,7 @@ class AdvancedAIHandler(BaseHTTPRequestHandler):
         print(f"🌐 Advanced AI: {format % args}")
 
 def main():
+    started = time.perf_counter()
     PORT = int(os.environ.get('PORT', 8000))
     
     print(f"🚀 Запуск Advanced AI Assistant на порту {PORT}...")
@@ -1759,17 +4310,38 @@ def main():
     print("• Искусственный интеллект и ML")
     print("• Технологии и интернет")
     
+    # SIGTERM (обычная остановка в окружениях с PORT) завершает работу так же, как Ctrl+C,
+    # чтобы отложенная статистика и журнал разговоров были записаны
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    server = None
     try:
-        server = HTTPServer(('0.0.0.0', PORT), AdvancedAIHandler)
+        AdvancedAIHandler.started = started
+        AdvancedAIHandler.ai = DeepSeekLevelAI()
+        server = PooledHTTPServer(('0.0.0.0', PORT), AdvancedAIHandler)
+        
+        # Целевое время проверяется по первому отвеченному запросу (_report_first_answer)
+        print(f"\n⏱️ Порт открыт за {(time.perf_counter() - started) * 1000:.0f} мс")
+        
         print(f"\n✅ Advanced AI Assistant активирован на порту {PORT}")
         print("💫 Расширенная база знаний готова к работе!")
         print("🔮 Задавайте вопросы через веб-интерфейс!")
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 AI Assistant деактивирован")
-        print("💾 Сохранение данных...")
     except Exception as e:
         print(f"❌ Ошибка запуска: {e}")
+    finally:
+        # Повторный сигнал не должен прервать запись накопленных данных
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if server is not None:
+            server.server_close()
+        # Объекта может не быть, если остановка пришла во время его создания
+        if AdvancedAIHandler.ai is not None:
+            print("💾 Сохранение данных...")
+            AdvancedAIHandler.ai.shutdown()
 
 if __name__ == '__main__':
     main()